@@ -1,10 +1,18 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User
+from .models import User, ReferencePhoto
+
+
+class ReferencePhotoInline(admin.TabularInline):
+    model = ReferencePhoto
+    fields = ('image', 'uploaded_at')
+    readonly_fields = ('uploaded_at',)
+    extra = 0
 
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
+    inlines = [ReferencePhotoInline]
     list_display = ('email', 'username', 'first_name', 'last_name', 'is_staff', 'is_online')
     list_filter = ('is_staff', 'is_superuser', 'is_active', 'is_online')
     search_fields = ('email', 'username', 'first_name', 'last_name')
@@ -3,6 +3,7 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import get_user_model
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit, Row, Column
+from .models import ReferencePhoto
 
 User = get_user_model()
 
@@ -63,3 +64,34 @@ class UserUpdateForm(forms.ModelForm):
             'bio',
             'avatar',
         )
+    
+    def save(self, commit=True):
+        user = super().save(commit=False)
+        avatar_changed = 'avatar' in self.changed_data
+        if avatar_changed:
+            # Stored embeddings belong to the old photo
+            user.face_encoding = None
+        if commit:
+            user.save()
+            if avatar_changed:
+                # Also when cleared, so the old embeddings leave the store and the 1:N index
+                from meetings.face.embeddings import refresh_avatar_encoding
+                refresh_avatar_encoding(user)
+        return user
+
+
+class ReferencePhotoForm(forms.ModelForm):
+    class Meta:
+        model = ReferencePhoto
+        fields = ['image']
+        labels = {
+            'image': 'Reference photo',
+        }
+        help_texts = {
+            'image': 'Another clear photo of your face, e.g. with different lighting or glasses. It must match your profile photo.',
+        }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.form_tag = False
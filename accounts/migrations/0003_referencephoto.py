@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_user_face_encoding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferencePhoto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to='references/')),
+                ('face_encoding', models.TextField(blank=True, help_text='Embeddings of this photo', null=True)),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reference_photos', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['uploaded_at'],
+            },
+        ),
+    ]
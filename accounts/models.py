@@ -23,3 +23,17 @@ class User(AbstractUser):
         return f"{self.first_name} {self.last_name}"
 
 
+
+
+class ReferencePhoto(models.Model):
+    """Extra enrollment photo compared alongside the avatar during face verification"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reference_photos')
+    image = models.ImageField(upload_to='references/')
+    face_encoding = models.TextField(blank=True, null=True, help_text="Embeddings of this photo")
+    uploaded_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['uploaded_at']
+    
+    def __str__(self):
+        return f"{self.user} reference photo {self.pk}"
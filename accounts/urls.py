@@ -9,6 +9,8 @@ urlpatterns = [
     path('logout/', views.CustomLogoutView.as_view(), name='logout'),
     path('register/', views.UserRegistrationView.as_view(), name='register'),
     path('profile/', views.profile_view, name='profile'),
+    path('profile/references/add/', views.reference_photo_add, name='reference_photo_add'),
+    path('profile/references/<int:pk>/delete/', views.reference_photo_delete, name='reference_photo_delete'),
 ]
 
 
@@ -1,4 +1,4 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
@@ -6,8 +6,10 @@ from django.contrib.auth.views import LoginView, LogoutView
 from django.urls import reverse_lazy
 from django.views.generic import CreateView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .models import User
-from .forms import UserRegistrationForm, UserUpdateForm
+from django.conf import settings
+from django.views.decorators.http import require_POST
+from .models import User, ReferencePhoto
+from .forms import UserRegistrationForm, UserUpdateForm, ReferencePhotoForm
 
 
 class CustomLoginView(LoginView):
@@ -50,7 +52,61 @@ def profile_view(request):
     
     return render(request, 'accounts/profile.html', {
         'form': form,
+        'reference_form': ReferencePhotoForm(),
+        'reference_photos': request.user.reference_photos.all(),
+        'max_reference_photos': settings.FACE_GALLERY_MAX_PHOTOS,
         'user': request.user
     })
 
 
+
+
+@login_required
+@require_POST
+def reference_photo_add(request):
+    """Enroll an extra photo used alongside the avatar for face verification"""
+    if request.user.reference_photos.count() >= settings.FACE_GALLERY_MAX_PHOTOS:
+        messages.error(request, f'You can add at most {settings.FACE_GALLERY_MAX_PHOTOS} reference photos.')
+        return redirect('accounts:profile')
+    
+    if not request.user.avatar:
+        messages.error(request, 'Please upload a profile photo before adding reference photos.')
+        return redirect('accounts:profile')
+    
+    form = ReferencePhotoForm(request.POST, request.FILES)
+    if form.is_valid():
+        photo = form.save(commit=False)
+        photo.user = request.user
+        photo.save()
+        
+        from meetings.face.embeddings import photo_matches_avatar, refresh_gallery, refresh_photo_encoding
+        # Only photos of the face in the avatar may vouch for the user
+        refresh_photo_encoding(photo)
+        matches = photo_matches_avatar(photo)
+        if not matches:
+            photo.image.delete(save=False)
+            photo.delete()
+            if matches is None:
+                messages.error(request, 'Your reference photo could not be checked right now. Please try again later with a clear photo of your face.')
+            else:
+                messages.error(request, 'The reference photo does not match your profile photo. Please upload a photo of yourself.')
+            return redirect('accounts:profile')
+        
+        refresh_gallery(request.user)
+        messages.success(request, 'Reference photo added!')
+    else:
+        messages.error(request, 'Please upload a valid image.')
+    return redirect('accounts:profile')
+
+
+@login_required
+@require_POST
+def reference_photo_delete(request, pk):
+    photo = get_object_or_404(ReferencePhoto, pk=pk, user=request.user)
+    photo.image.delete(save=False)
+    photo.delete()
+    
+    from meetings.face.embeddings import refresh_gallery
+    refresh_gallery(request.user)
+    messages.success(request, 'Reference photo removed.')
+    return redirect('accounts:profile')
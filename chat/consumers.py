@@ -1,36 +1,106 @@
+import asyncio
+import collections
+import hashlib
 import json
+import threading
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from . import outbox, roster
 from .models import ChatMessage
-from meetings.models import Meeting, MeetingParticipant
+from meetings.models import Meeting
+
+# WebRTC signals relayed per meeting in this process, split by delivery
+_signal_lock = threading.Lock()
+_signal_counts = collections.defaultdict(collections.Counter)
+
+
+def count_signal(meeting_id, delivery):
+    with _signal_lock:
+        _signal_counts[str(meeting_id)][delivery] += 1
+
+
+def signaling_stats(meeting_id):
+    with _signal_lock:
+        counts = _signal_counts.get(str(meeting_id), collections.Counter())
+        return {
+            'targeted': counts['targeted'],
+            'broadcast': counts['broadcast'],
+        }
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    def user_group_name(self, user_id):
+        # Every connection of a user in this meeting, for private delivery
+        return f'meeting_{self.meeting_id}_user_{user_id}'
+    
+    def peer_group_name(self, username):
+        # The connections of a participant by username, the address WebRTC signals use.
+        # Usernames may contain '@' and '+', which group names cannot, hence the digest.
+        digest = hashlib.sha1(username.encode()).hexdigest()[:20]
+        return f'meeting_{self.meeting_id}_peer_{digest}'
+    
     async def connect(self):
         self.meeting_id = self.scope['url_route']['kwargs']['meeting_id']
         self.meeting_group_name = f'meeting_{self.meeting_id}'
+        self.user = self.scope['user']
+        self.presence = None
+        
+        # Resolved once per connection: the meeting, the sender's profile fields and
+        # the participants who can receive private messages (kept current by roster deltas)
+        self.meeting, self.recipients = await self.load_meeting()
+        if self.meeting is None:
+            await self.close()
+            return
+        self.sender = {
+            'id': self.user.id,
+            'username': self.user.username,
+            'full_name': self.user.full_name,
+        } if self.user.is_authenticated else None
         
         # Join meeting group
         await self.channel_layer.group_add(
             self.meeting_group_name,
             self.channel_name
         )
+        if self.user.is_authenticated:
+            await self.channel_layer.group_add(
+                self.user_group_name(self.user.id),
+                self.channel_name
+            )
+            await self.channel_layer.group_add(
+                self.peer_group_name(self.user.username),
+                self.channel_name
+            )
+            # Others get a join delta; this client loads the roster snapshot itself
+            await roster.join(self.channel_layer, self.meeting_group_name, self.meeting_id, self.user)
+            self.presence = asyncio.ensure_future(roster.keep_alive(self.meeting_id, self.user))
         
         await self.accept()
-        
-        # Send meeting participants update
-        await self.send_participants_update()
     
     async def disconnect(self, close_code):
+        if self.meeting is None:
+            return
+        
         # Leave meeting group
         await self.channel_layer.group_discard(
             self.meeting_group_name,
             self.channel_name
         )
-        
-        # Send participants update
-        await self.send_participants_update()
+        if self.user.is_authenticated:
+            await self.channel_layer.group_discard(
+                self.user_group_name(self.user.id),
+                self.channel_name
+            )
+            await self.channel_layer.group_discard(
+                self.peer_group_name(self.user.username),
+                self.channel_name
+            )
+            if self.presence is not None:
+                self.presence.cancel()
+            await roster.leave(self.channel_layer, self.meeting_group_name, self.meeting_id, self.user)
     
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
@@ -48,32 +118,42 @@ class ChatConsumer(AsyncWebsocketConsumer):
         message_type = data.get('message_type', 'text')
         recipient_id = data.get('recipient_id', None)
         
-        # Save message to database
-        message = await self.save_message(content, message_type, recipient_id)
+        if self.sender is None:
+            return
+        recipient = await self.find_recipient(recipient_id) if recipient_id else None
+        
+        # Build the message; it is written to the database after the broadcast
+        message = ChatMessage(
+            meeting=self.meeting,
+            sender_id=self.sender['id'],
+            recipient_id=recipient['id'] if recipient else None,
+            content=content,
+            message_type=message_type
+        )
         
         # Prepare message data
         message_data = {
-            'id': message.id,
-            'sender': message.sender.username,
-            'sender_id': message.sender.id,
-            'sender_full_name': message.sender.full_name,
+            'id': str(message.uid),
+            'sender': self.sender['username'],
+            'sender_id': self.sender['id'],
+            'sender_full_name': self.sender['full_name'],
             'content': message.content,
             'message_type': message.message_type,
             'timestamp': message.timestamp.isoformat(),
-            'recipient_id': message.recipient.id if message.recipient else None,
-            'recipient_name': message.recipient.username if message.recipient else None,
+            'recipient_id': recipient['id'] if recipient else None,
+            'recipient_name': recipient['username'] if recipient else None,
         }
         
-        if recipient_id:
-            # Private message - send only to sender and recipient via group (filtered on client)
-            # Note: For true privacy, you'd need to track user channels separately
-            await self.channel_layer.group_send(
-                self.meeting_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message_data
-                }
-            )
+        if recipient:
+            # Private message - only the sender's and the recipient's connections get it
+            for user_id in {self.sender['id'], recipient['id']}:
+                await self.channel_layer.group_send(
+                    self.user_group_name(user_id),
+                    {
+                        'type': 'chat_message',
+                        'message': message_data
+                    }
+                )
         else:
             # Public message - send to all participants
             await self.channel_layer.group_send(
@@ -83,28 +163,35 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'message': message_data
                 }
             )
+        
+        if outbox.save(message):
+            # The write-behind queue is full; wait for it before taking more messages
+            await database_sync_to_async(outbox.flush, thread_sensitive=False)()
     
     async def handle_participant_update(self, data):
-        # Broadcast participant status update
-        await self.channel_layer.group_send(
-            self.meeting_group_name,
-            {
-                'type': 'participant_update',
-                'participant': data['participant']
-            }
-        )
+        # Participants report their own audio/video/screen state, which goes out as a roster delta
+        if self.user.is_authenticated:
+            await roster.update_state(
+                self.channel_layer, self.meeting_group_name, self.meeting_id, self.user, data['participant']
+            )
     
     async def handle_webrtc_signal(self, data):
-        # Broadcast WebRTC signal to other participants
-        await self.channel_layer.group_send(
-            self.meeting_group_name,
-            {
-                'type': 'webrtc_signal',
-                'signal': data['signal'],
-                'target': data.get('target'),
-                'sender': self.scope['user'].username if self.scope['user'] != AnonymousUser() else None
-            }
-        )
+        target = data.get('target')
+        event = {
+            'type': 'webrtc_signal',
+            'signal': data['signal'],
+            'target': target,
+            'sender': self.scope['user'].username if self.scope['user'] != AnonymousUser() else None
+        }
+        
+        if target:
+            # Offers, answers and ICE candidates go only to the peer they are for
+            await self.channel_layer.group_send(self.peer_group_name(target), event)
+            count_signal(self.meeting_id, 'targeted')
+        else:
+            # Untargeted signals are still broadcast to the meeting
+            await self.channel_layer.group_send(self.meeting_group_name, event)
+            count_signal(self.meeting_id, 'broadcast')
     
     async def chat_message(self, event):
         # Send message to WebSocket
@@ -113,13 +200,6 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message': event['message']
         }))
     
-    async def participant_update(self, event):
-        # Send participant update to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'participant_update',
-            'participant': event['participant']
-        }))
-    
     async def webrtc_signal(self, event):
         # Send WebRTC signal to WebSocket
         await self.send(text_data=json.dumps({
@@ -129,60 +209,48 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'sender': event.get('sender')
         }))
     
-    async def participants_list(self, event):
-        # Send participants list to WebSocket
+    async def roster_delta(self, event):
+        # Participants who leave can still be sent private messages, so they stay in the table
+        for change in event['changes']:
+            if change['op'] != 'leave':
+                self.recipients[change['participant']['id']] = change['participant']
+        
+        # Send roster changes to WebSocket
         await self.send(text_data=json.dumps({
-            'type': 'participants_list',
-            'participants': event['participants']
+            'type': 'roster_delta',
+            'seq': event['seq'],
+            'changes': event['changes']
         }))
     
     @database_sync_to_async
-    def save_message(self, content, message_type, recipient_id=None):
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        
-        meeting = Meeting.objects.get(id=self.meeting_id)
-        recipient = None
-        
-        if recipient_id:
-            try:
-                recipient = User.objects.get(id=recipient_id)
-            except User.DoesNotExist:
-                pass
-        
-        return ChatMessage.objects.create(
-            meeting=meeting,
-            sender=self.scope['user'],
-            recipient=recipient,
-            content=content,
-            message_type=message_type
-        )
-    
+    def load_meeting(self):
+        try:
+            meeting = Meeting.objects.get(id=self.meeting_id)
+        except (Meeting.DoesNotExist, ValidationError):
+            return None, {}
+        _, participants = roster.snapshot(meeting.id)
+        return meeting, {participant['id']: participant for participant in participants}
     
-    async def send_participants_update(self):
-        participants = await self.get_meeting_participants()
-        await self.channel_layer.group_send(
-            self.meeting_group_name,
-            {
-                'type': 'participants_list',
-                'participants': participants
-            }
-        )
+    async def find_recipient(self, recipient_id):
+        try:
+            recipient_id = int(recipient_id)
+        except (TypeError, ValueError):
+            return None
+        if recipient_id not in self.recipients:
+            # Not on the roster since connect (e.g. chat closed all along); look them up once
+            recipient = await self.get_recipient(recipient_id)
+            if recipient is None:
+                return None
+            self.recipients[recipient_id] = recipient
+        return self.recipients[recipient_id]
     
     @database_sync_to_async
-    def get_meeting_participants(self):
-        meeting = Meeting.objects.get(id=self.meeting_id)
-        participants = []
-        for participant in meeting.meeting_participants.all():
-            participants.append({
-                'id': participant.user.id,
-                'username': participant.user.username,
-                'full_name': participant.user.full_name,
-                'is_audio_enabled': participant.is_audio_enabled,
-                'is_video_enabled': participant.is_video_enabled,
-                'is_screen_sharing': participant.is_screen_sharing,
-            })
-        return participants
-
-
-
+    def get_recipient(self, recipient_id):
+        from django.contrib.auth import get_user_model
+        User = get_user_model()
+        
+        try:
+            user = User.objects.get(id=recipient_id)
+        except User.DoesNotExist:
+            return None
+        return {'id': user.id, 'username': user.username, 'full_name': user.full_name}
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:20
+
+import uuid
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def gen_uid(apps, schema_editor):
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    for message in ChatMessage.objects.only('pk'):
+        message.uid = uuid.uuid4()
+        message.save(update_fields=['uid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_chatmessage_recipient_alter_chatmessage_sender_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='uid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, null=True),
+        ),
+        migrations.RunPython(gen_uid, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='uid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,5 +1,8 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from meetings.models import Meeting
 
 User = get_user_model()
@@ -13,13 +16,15 @@ class ChatMessage(models.Model):
         ('system', 'System'),
     ]
     
+    # Assigned when the message is broadcast, before it is written (see chat.outbox)
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     meeting = models.ForeignKey(Meeting, on_delete=models.CASCADE, related_name='chat_messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages', null=True, blank=True, help_text="If set, this is a private message. If null, it's a public message.")
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES, default='text')
     content = models.TextField()
     file = models.FileField(upload_to='chat_files/', null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     is_read = models.BooleanField(default=False)
     
     class Meta:
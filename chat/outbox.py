@@ -0,0 +1,83 @@
+"""
+Write-behind persistence of chat messages.
+
+The chat consumer builds each ``ChatMessage`` in memory (its ``uid`` and
+``timestamp`` are set on construction), broadcasts it right away and
+hands it to ``save()``. A background thread of this worker writes the
+queued messages with one ``bulk_create`` every ``CHAT_WRITE_BEHIND_MS``
+milliseconds, or as soon as ``CHAT_WRITE_BATCH_SIZE`` are waiting. When
+``CHAT_WRITE_MAX_PENDING`` messages are queued, ``save()`` asks the
+caller to flush before sending more, which bounds memory when the
+database falls behind. Whatever is left is flushed at interpreter exit.
+
+If a batch fails, its messages are retried one by one so a single bad
+row (say, of a meeting deleted meanwhile) does not lose the others.
+"""
+import atexit
+import collections
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_cond = threading.Condition()
+_flush_lock = threading.Lock()  # one writer at a time, so batches land in order
+_pending = collections.deque()
+_writer = None
+
+
+def save(message):
+    """Queue an unsaved message; return True when the caller should flush() before sending more"""
+    with _cond:
+        _start()
+        _pending.append(message)
+        # Wake the writer to start the wait for a batch, and again once it is full
+        if len(_pending) == 1 or len(_pending) >= settings.CHAT_WRITE_BATCH_SIZE:
+            _cond.notify()
+        return len(_pending) >= settings.CHAT_WRITE_MAX_PENDING
+
+
+def flush():
+    """Write every queued message now"""
+    from .models import ChatMessage
+
+    with _flush_lock:
+        with _cond:
+            batch = list(_pending)
+            _pending.clear()
+        if not batch:
+            return
+        try:
+            ChatMessage.objects.bulk_create(batch)
+        except Exception:
+            logger.exception("Could not save a batch of %s chat messages, saving them one by one", len(batch))
+            for message in batch:
+                try:
+                    message.save(force_insert=True)
+                except Exception:
+                    logger.exception("Dropped chat message %s", message.uid)
+
+
+def _run():
+    while True:
+        with _cond:
+            _cond.wait_for(lambda: _pending)
+            # Give a burst a moment to fill the batch
+            _cond.wait_for(
+                lambda: len(_pending) >= settings.CHAT_WRITE_BATCH_SIZE,
+                timeout=settings.CHAT_WRITE_BEHIND_MS / 1000,
+            )
+        close_old_connections()
+        flush()
+
+
+def _start():
+    # Called with _cond held
+    global _writer
+    if _writer is None:
+        _writer = threading.Thread(target=_run, name='chat-write-behind', daemon=True)
+        _writer.start()
+        atexit.register(flush)
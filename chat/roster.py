@@ -0,0 +1,166 @@
+"""
+Versioned participant roster of the meeting chat.
+
+Participants are on the roster while they have the meeting room open,
+which keeps its chat socket connected whether or not the chat panel is
+shown. Open connections are counted per participant in the default
+cache, apart from the attendance record (``MeetingParticipant.left_at``).
+The count expires after ``CHAT_ROSTER_PRESENCE_TTL`` seconds unless a
+connected socket refreshes it (``keep_alive``). A worker that dies
+without running ``leave()`` therefore cannot keep its participants on
+the roster for good.
+Instead of re-sending the whole roster on every connect and disconnect,
+the consumer queues ``join``, ``leave`` and ``state`` changes here.
+Changes queued within ``CHAT_ROSTER_COALESCE_MS`` are merged per
+participant and broadcast as one ``roster_delta`` event carrying the
+meeting's next sequence number.
+
+Clients load a snapshot (``get_meeting_participants``, which includes
+the ``seq`` it reflects) and apply deltas in order; on any gap they load
+a new snapshot. The sequence and connection counters live in the default
+cache, which has to be shared between workers when there is more than
+one, as the channel layer is. They go through the backend's own
+``incr()``, which is atomic and keeps the key's expiry (the generic
+``aincr()`` is a get and a set).
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from meetings.models import MeetingParticipant
+
+STATE_FIELDS = ('is_audio_enabled', 'is_video_enabled', 'is_screen_sharing')
+
+_pending = {}  # meeting id -> {user id: latest change}
+_flushes = set()
+
+
+def _seq_key(meeting_id):
+    return f'chat_roster_seq:{meeting_id}'
+
+
+def _online_key(meeting_id, user_id):
+    return f'chat_roster_online:{meeting_id}:{user_id}'
+
+
+@sync_to_async(thread_sensitive=False)
+def _add_to_counter(key, delta, timeout=None):
+    """Add delta to a cache counter, creating it (with timeout) when delta is positive"""
+    if delta > 0:
+        cache.add(key, 0, timeout=timeout)
+    return cache.incr(key, delta)
+
+
+def entry(participant):
+    return {
+        'id': participant.user.id,
+        'username': participant.user.username,
+        'full_name': participant.user.full_name,
+        'is_audio_enabled': participant.is_audio_enabled,
+        'is_video_enabled': participant.is_video_enabled,
+        'is_screen_sharing': participant.is_screen_sharing,
+    }
+
+
+def snapshot(meeting_id):
+    """Return (seq, participants); seq is read first, so later deltas are never missed"""
+    seq = cache.get(_seq_key(meeting_id), 0)
+    participants = list(
+        MeetingParticipant.objects.filter(meeting_id=meeting_id).select_related('user').defer('user__face_encoding')
+    )
+    online = cache.get_many([_online_key(meeting_id, participant.user_id) for participant in participants])
+    return seq, [
+        entry(participant) for participant in participants
+        if online.get(_online_key(meeting_id, participant.user_id), 0) > 0
+    ]
+
+
+def _participant(meeting_id, user):
+    return MeetingParticipant.objects.select_related('user').defer('user__face_encoding').filter(
+        meeting_id=meeting_id, user=user
+    ).first()
+
+
+@database_sync_to_async
+def _entry(meeting_id, user):
+    participant = _participant(meeting_id, user)
+    return entry(participant) if participant is not None else None
+
+
+@database_sync_to_async
+def _set_state(meeting_id, user, state):
+    participant = _participant(meeting_id, user)
+    if participant is None:
+        return None
+    for field, value in state.items():
+        setattr(participant, field, value)
+    participant.save(update_fields=list(state))
+    return entry(participant)
+
+
+async def join(channel_layer, group, meeting_id, user):
+    participant = await _entry(meeting_id, user)
+    if participant is None:
+        return
+    await _count_connection(meeting_id, user)
+    _queue(channel_layer, group, meeting_id, user.id, {'op': 'join', 'participant': participant})
+
+
+async def _count_connection(meeting_id, user):
+    await _add_to_counter(_online_key(meeting_id, user.id), 1, settings.CHAT_ROSTER_PRESENCE_TTL)
+
+
+async def keep_alive(meeting_id, user):
+    """Refresh the presence of a joined connection until cancelled"""
+    ttl = settings.CHAT_ROSTER_PRESENCE_TTL
+    while True:
+        await asyncio.sleep(ttl / 3)
+        if not await cache.atouch(_online_key(meeting_id, user.id), ttl):
+            # Expired or evicted while connected; count this connection again
+            await _count_connection(meeting_id, user)
+
+
+async def leave(channel_layer, group, meeting_id, user):
+    """Called for every connection join() was called for; the last one to close leaves"""
+    try:
+        connections = await _add_to_counter(_online_key(meeting_id, user.id), -1)
+    except ValueError:
+        return  # never counted, e.g. no participant row
+    if connections > 0:
+        return
+    _queue(channel_layer, group, meeting_id, user.id, {'op': 'leave', 'id': user.id})
+
+
+async def update_state(channel_layer, group, meeting_id, user, data):
+    """Persist the audio/video/screen flags a participant reports for themselves"""
+    state = {field: bool(data[field]) for field in STATE_FIELDS if field in data}
+    if not state:
+        return
+    participant = await _set_state(meeting_id, user, state)
+    if participant is not None:
+        _queue(channel_layer, group, meeting_id, user.id, {'op': 'state', 'participant': participant})
+
+
+def _queue(channel_layer, group, meeting_id, user_id, change):
+    # Every change carries the participant's whole entry, so the latest one per participant wins
+    if meeting_id not in _pending:
+        _pending[meeting_id] = {}
+        task = asyncio.ensure_future(_flush_later(channel_layer, group, meeting_id))
+        _flushes.add(task)
+        task.add_done_callback(_flushes.discard)
+    _pending[meeting_id][user_id] = change
+
+
+async def _flush_later(channel_layer, group, meeting_id):
+    await asyncio.sleep(settings.CHAT_ROSTER_COALESCE_MS / 1000)
+    changes = _pending.pop(meeting_id)
+
+    seq = await _add_to_counter(_seq_key(meeting_id), 1)
+    await channel_layer.group_send(group, {
+        'type': 'roster_delta',
+        'seq': seq,
+        'changes': list(changes.values()),
+    })
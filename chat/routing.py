@@ -2,7 +2,7 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
-    re_path(r'ws/chat/(?P<meeting_id>\w+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/chat/(?P<meeting_id>[0-9a-f-]+)/$', consumers.ChatConsumer.as_asgi()),
 ]
 
 
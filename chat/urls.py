@@ -4,9 +4,6 @@ from . import views
 app_name = 'chat'
 
 urlpatterns = [
-    # Chat URLs can be added here if needed
-    # Currently, chat functionality is handled via WebSockets
+    # Chat functionality is handled via WebSockets
+    path('<uuid:meeting_id>/signaling/', views.signaling_stats, name='signaling_stats'),
 ]
-
-
-
@@ -1,8 +1,20 @@
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+
+from meetings.models import Meeting
 
 # Chat functionality is primarily handled via WebSockets
 # This file can be extended with additional views if needed
 
 
-
+@login_required
+def signaling_stats(request, meeting_id):
+    """WebRTC signals this worker relayed for a meeting, targeted vs broadcast (host only)"""
+    from .consumers import signaling_stats as stats
+    
+    meeting = get_object_or_404(Meeting, pk=meeting_id)
+    if meeting.host != request.user:
+        return JsonResponse({'error': 'Only the host can view signaling stats'}, status=403)
+    
+    return JsonResponse({'meeting_id': str(meeting.id), **stats(meeting.id)})
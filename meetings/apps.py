@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class MeetingsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'meetings'
+    
+    def ready(self):
+        # Size the inference thread pools before TensorFlow / BLAS are first imported
+        from .face.threads import apply
+        apply()
+
+        if settings.FACE_WARMUP:
+            from .face.warmup import start_warm_up
+            start_warm_up()
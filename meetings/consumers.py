@@ -0,0 +1,265 @@
+import asyncio
+import json
+import time
+import uuid
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Meeting
+
+# Bounds the re-verification inferences running at once across all connections of this process
+_recheck_slots = None
+# Same for lobby verifications submitted over VerificationConsumer
+_verify_slots = None
+
+
+def _get_recheck_slots():
+    global _recheck_slots
+    if _recheck_slots is None:
+        _recheck_slots = asyncio.Semaphore(settings.FACE_RECHECK_CONCURRENCY)
+    return _recheck_slots
+
+
+def _get_verify_slots():
+    global _verify_slots
+    if _verify_slots is None:
+        _verify_slots = asyncio.Semaphore(settings.FACE_VERIFY_CONCURRENCY)
+    return _verify_slots
+
+
+class IdentityConsumer(AsyncWebsocketConsumer):
+    """Periodic in-meeting identity re-verification.
+
+    Participants send small JPEG frames as binary messages. Frames are
+    rate-limited, skipped while a check is running, short-circuited by the
+    perceptual change gate when unchanged, and compared with the cached
+    avatar and reference photo embeddings off the event loop. After
+    FACE_RECHECK_MISMATCHES consecutive mismatches the host is alerted.
+    So is the host when a participant sends no frame for
+    FACE_RECHECK_MISSED intervals, e.g. with their camera turned off.
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        self.meeting_id = self.scope['url_route']['kwargs']['meeting_id']
+        self.host_group_name = f'identity_{self.meeting_id}_host'
+
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        role = await self.get_role()
+        if role is None:
+            await self.close()
+            return
+
+        self.is_host = role == 'host'
+        self.references = None
+        self.model_name = settings.FACE_MODELS[0]
+        self.last_checked = 0.0
+        self.checking = False
+        self.mismatches = 0
+        self.last_frame = time.monotonic()
+        self.watchdog = None
+
+        if self.is_host:
+            await self.channel_layer.group_add(self.host_group_name, self.channel_name)
+        await self.accept()
+        if not self.is_host and settings.FACE_RECHECK_INTERVAL and settings.FACE_RECHECK_MISSED:
+            self.watchdog = asyncio.ensure_future(self.watch_frames())
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'is_host', False):
+            await self.channel_layer.group_discard(self.host_group_name, self.channel_name)
+        if getattr(self, 'watchdog', None) is not None:
+            self.watchdog.cancel()
+
+    async def watch_frames(self):
+        """Alert the host once per silence when the participant stops sending frames"""
+        interval = settings.FACE_RECHECK_INTERVAL
+        alerted_for = None
+        while True:
+            await asyncio.sleep(interval)
+            missed = int((time.monotonic() - self.last_frame) // interval)
+            if missed >= settings.FACE_RECHECK_MISSED and alerted_for != self.last_frame:
+                alerted_for = self.last_frame
+                await self.alert_host('no_frames', missed_checks=missed)
+
+    async def alert_host(self, reason, **details):
+        await self.channel_layer.group_send(self.host_group_name, {
+            'type': 'identity_alert',
+            'reason': reason,
+            'user_id': self.user.id,
+            'username': self.user.username,
+            'full_name': self.user.full_name,
+            'timestamp': timezone.now().isoformat(),
+            **details,
+        })
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if not bytes_data or self.is_host:
+            return
+
+        now = time.monotonic()
+        self.last_frame = now
+        if self.checking or now - self.last_checked < settings.FACE_RECHECK_MIN_INTERVAL:
+            return
+
+        self.checking = True
+        self.last_checked = now
+        asyncio.ensure_future(self.check_frame(bytes_data))
+
+    def run_check(self, frame):
+        from .face import gate, load
+        from .face.verification import compare_frame
+
+        # A still candidate produces near-identical frames; reuse the last result for those
+        gate_key = f'identity:{self.channel_name}'
+        result = gate.check(gate_key, frame)
+        if result is None:
+            with load.track(self.model_name):
+                result = compare_frame(self.references, frame, self.model_name)
+            gate.remember(gate_key, frame, result)
+        return result
+
+    async def check_frame(self, data):
+        from .face import load
+        from .face.frames import Frame
+
+        # Periodic re-checks are the first to go when the worker is overloaded
+        if load.admit() == load.SHED:
+            self.checking = False
+            return
+
+        try:
+            async with _get_recheck_slots():
+                if self.references is None:
+                    # May embed the avatar on a miss, so it must not hold up the shared DB thread
+                    self.references = await database_sync_to_async(self.load_references, thread_sensitive=False)()
+                    if self.references is None:
+                        return
+                matched, similarity = await sync_to_async(self.run_check, thread_sensitive=False)(Frame(data))
+        except Exception as e:
+            await self.send(text_data=json.dumps({'type': 'identity_unavailable', 'error': str(e)}))
+            return
+        finally:
+            self.checking = False
+
+        self.mismatches = 0 if matched else self.mismatches + 1
+        await self.send(text_data=json.dumps({
+            'type': 'identity_result',
+            'matched': matched,
+            'similarity': round(similarity, 3),
+        }))
+        if self.mismatches >= settings.FACE_RECHECK_MISMATCHES:
+            await self.alert_host(
+                'mismatch', similarity=round(similarity, 3), consecutive_mismatches=self.mismatches
+            )
+
+    async def identity_alert(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    @database_sync_to_async
+    def get_role(self):
+        meeting = Meeting.objects.filter(id=self.meeting_id).first()
+        if meeting is None:
+            return None
+        if meeting.host_id == self.user.id:
+            return 'host'
+        if meeting.participants.filter(id=self.user.id).exists():
+            return 'participant'
+        return None
+
+    def load_references(self):
+        from .face.embeddings import get_references
+
+        if not self.user.avatar:
+            return None
+        return get_references(self.user, self.model_name)
+
+
+class VerificationConsumer(AsyncWebsocketConsumer):
+    """Lobby face verification without holding an HTTP request open.
+
+    Each binary message is one job: one or more JPEG frames, each prefixed
+    with its length as a 4-byte big-endian integer. The job id is sent
+    back at once, followed by ``progress`` stages and the ``result``,
+    which carries the HTTP status verify_face would have answered with.
+    The pipeline runs in a worker thread, so waiting candidates only cost
+    an idle socket.
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        self.job_id = None
+        await self.accept()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        from .face.frames import Frame
+
+        if not bytes_data:
+            return
+        if self.job_id is not None:
+            await self.send(text_data=json.dumps({
+                'type': 'job_rejected',
+                'error': 'A verification is already running.',
+            }))
+            return
+        try:
+            frames = Frame.list_from_bytes(bytes_data)
+        except ValueError as e:
+            await self.send(text_data=json.dumps({'type': 'job_rejected', 'error': str(e)}))
+            return
+        if not frames:
+            return
+
+        self.job_id = uuid.uuid4().hex
+        await self.send(text_data=json.dumps({'type': 'job_accepted', 'job_id': self.job_id}))
+        asyncio.ensure_future(self.run_job(self.job_id, frames))
+
+    async def run_job(self, job_id, frames):
+        from .face import load
+        from .face.pipeline import busy
+
+        try:
+            # An overloaded worker answers busy at once instead of queueing the job
+            if load.shedding():
+                rejected = busy()
+                status, result = rejected.status, {**rejected.payload, 'retry_after': rejected.retry_after}
+            else:
+                await self.send_progress(job_id, 'queued')
+                slots = _get_verify_slots()
+                with load.queued():
+                    await slots.acquire()
+                try:
+                    status, result = await database_sync_to_async(self.verify, thread_sensitive=False)(job_id, frames)
+                finally:
+                    slots.release()
+        except Exception as e:
+            status, result = 500, {'success': False, 'error': str(e)}
+        finally:
+            self.job_id = None
+        await self.send(text_data=json.dumps({'type': 'result', 'job_id': job_id, 'status': status, **result}))
+
+    def verify(self, job_id, frames):
+        from .face.pipeline import Rejected, verify_frame, verify_frames
+
+        def progress(stage):
+            async_to_sync(self.send_progress)(job_id, stage)
+
+        session_key = self.scope['session'].session_key
+        try:
+            if len(frames) == 1:
+                return 200, verify_frame(self.user, frames[0], session_key, progress)
+            return 200, verify_frames(self.user, frames, settings.FACE_BURST_AGGREGATE, session_key, progress)
+        except Rejected as e:
+            return e.status, {**e.payload, 'retry_after': e.retry_after}
+
+    async def send_progress(self, job_id, stage):
+        await self.send(text_data=json.dumps({'type': 'progress', 'job_id': job_id, 'stage': stage}))
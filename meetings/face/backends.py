@@ -0,0 +1,172 @@
+"""
+Embedding backends for face verification.
+
+``FACE_EMBEDDING_BACKEND`` selects how embeddings are computed:
+
+* ``deepface`` - DeepFace on tf-keras (default).
+* ``onnx`` - ONNX Runtime sessions for the models listed in
+  ``FACE_ONNX_MODELS``; anything without an ONNX file is delegated to
+  DeepFace. Export the weights with ``manage.py export_face_onnx``.
+
+Both produce vectors in the same embedding space for a given model, so
+the match threshold and stored avatar embeddings keep their meaning.
+With ``FACE_PREPROCESS`` the images are already face crops and the
+backends skip their own detection.
+"""
+import threading
+
+from django.conf import settings
+
+
+class EmbeddingBackend:
+    name = None
+
+    def load(self, model_name):
+        """Load the model weights ahead of the first request"""
+        raise NotImplementedError
+
+    def embed_batch(self, images, model_name):
+        """Return one float32 embedding per image path / BGR array"""
+        raise NotImplementedError
+
+    def embed(self, image, model_name):
+        return self.embed_batch([image], model_name)[0]
+
+    def warm_up(self, model_name):
+        import numpy as np
+
+        self.load(model_name)
+        self.embed(np.zeros((224, 224, 3), dtype=np.uint8), model_name)
+
+
+class DeepFaceBackend(EmbeddingBackend):
+    name = 'deepface'
+
+    @property
+    def detector_backend(self):
+        return 'skip' if settings.FACE_PREPROCESS else 'opencv'
+
+    def load(self, model_name):
+        from deepface import DeepFace
+        DeepFace.build_model(model_name)
+
+    def embed(self, image, model_name):
+        import numpy as np
+        from deepface import DeepFace
+
+        embedding = DeepFace.represent(
+            img_path=image,
+            model_name=model_name,
+            detector_backend=self.detector_backend,
+            enforce_detection=False
+        )[0]["embedding"]
+        return np.asarray(embedding, dtype=np.float32)
+
+    def embed_batch(self, images, model_name):
+        import numpy as np
+        from deepface import DeepFace
+
+        if len(images) == 1:
+            return [self.embed(images[0], model_name)]
+        # A list input makes DeepFace stack all faces into a single model.forward call
+        results = DeepFace.represent(
+            img_path=list(images),
+            model_name=model_name,
+            detector_backend=self.detector_backend,
+            enforce_detection=False
+        )
+        return [np.asarray(faces[0]["embedding"], dtype=np.float32) for faces in results]
+
+
+class OnnxBackend(EmbeddingBackend):
+    name = 'onnx'
+
+    # DeepFace input sizes (height, width) for the models we export
+    INPUT_SIZES = {
+        'Facenet512': (160, 160),
+        'Facenet': (160, 160),
+        'ArcFace': (112, 112),
+    }
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._fallback = DeepFaceBackend()
+
+    def _session(self, model_name):
+        with self._lock:
+            if model_name not in self._sessions:
+                import onnxruntime as ort
+                from .threads import budget
+
+                options = ort.SessionOptions()
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+                options.intra_op_num_threads = settings.FACE_ONNX_INTRA_OP_THREADS or budget()['intra_op']
+                options.inter_op_num_threads = settings.FACE_ONNX_INTER_OP_THREADS
+                self._sessions[model_name] = ort.InferenceSession(
+                    str(settings.FACE_ONNX_MODELS[model_name]),
+                    sess_options=options,
+                    providers=['CPUExecutionProvider'],
+                )
+            return self._sessions[model_name]
+
+    def _handles(self, model_name):
+        return model_name in settings.FACE_ONNX_MODELS
+
+    def load(self, model_name):
+        if not self._handles(model_name):
+            return self._fallback.load(model_name)
+        self._session(model_name)
+
+    def _prepare(self, image, size):
+        """Detect, crop and resize like DeepFace's opencv detector + resize_image"""
+        import cv2
+        import numpy as np
+
+        from .preprocessing import detect_face
+
+        if isinstance(image, str):
+            image = cv2.imread(image, cv2.IMREAD_COLOR)
+        box = None if settings.FACE_PREPROCESS else detect_face(image)
+        if box is not None:
+            x, y, w, h = box
+            image = image[y:y + h, x:x + w]
+
+        # Keep the aspect ratio and pad to the model input, as DeepFace does
+        target_h, target_w = size
+        factor = min(target_h / image.shape[0], target_w / image.shape[1])
+        resized = cv2.resize(image, (int(image.shape[1] * factor), int(image.shape[0] * factor)))
+        padded = np.zeros((target_h, target_w, 3), dtype=np.float32)
+        top = (target_h - resized.shape[0]) // 2
+        left = (target_w - resized.shape[1]) // 2
+        padded[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+        return padded / 255.0
+
+    def embed_batch(self, images, model_name):
+        import numpy as np
+
+        if not self._handles(model_name):
+            return self._fallback.embed_batch(images, model_name)
+        session = self._session(model_name)
+        size = self.INPUT_SIZES.get(model_name, (160, 160))
+        batch = np.stack([self._prepare(image, size) for image in images]).astype(np.float32)
+        outputs = session.run(None, {session.get_inputs()[0].name: batch})[0]
+        return [np.asarray(row, dtype=np.float32) for row in outputs]
+
+
+BACKENDS = {
+    DeepFaceBackend.name: DeepFaceBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[settings.FACE_EMBEDDING_BACKEND]()
+        return _backend
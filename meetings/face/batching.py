@@ -0,0 +1,118 @@
+"""
+Micro-batching of concurrent embedding requests.
+
+With ``FACE_BATCH_ENABLED`` every embedding request is queued per model;
+a collector thread waits up to ``FACE_BATCH_WINDOW_MS`` (or until
+``FACE_BATCH_MAX_SIZE`` frames are pending) and runs the whole batch
+through the model as one forward pass. Each caller blocks on its own
+future and gets back only its own embedding.
+
+If a batch fails because of one of its images (say, one without a
+detectable face), its images are embedded one by one so the others still
+get their embeddings. When the pool itself is unavailable (full, timed
+out, crashed) the whole batch fails at once instead.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from django.conf import settings
+
+from .pool import InferenceTimeout, InferenceUnavailable
+
+
+class EmbeddingBatcher:
+    def __init__(self, model_name, runner, window=0.03, max_batch=16, concurrency=1):
+        self.model_name = model_name
+        self.runner = runner
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        # Batches are handed off so the collector can keep filling the next one
+        self._dispatch = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='face-batch')
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._collect, name=f'face-batcher-{self.model_name}', daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, image, timeout=None):
+        """Queue one image and wait for its embedding"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((image, future))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            # Dropped from its batch if it has not been dispatched yet
+            future.cancel()
+            raise InferenceTimeout('Face verification timed out, please try again.')
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        batch = [(image, future) for image, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            embeddings = self.runner([image for image, _ in batch], self.model_name)
+        except Exception as e:
+            if len(batch) == 1 or isinstance(e, InferenceUnavailable):
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                self._run_one_by_one(batch)
+            return
+        except BaseException as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            future.set_result(embedding)
+
+    def _run_one_by_one(self, batch):
+        for image, future in batch:
+            try:
+                future.set_result(self.runner([image], self.model_name)[0])
+            except BaseException as e:
+                future.set_exception(e)
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(model_name):
+    from .pool import embed_batch
+    from .threads import pool_workers
+
+    with _batchers_lock:
+        if model_name not in _batchers:
+            # One batch per pool process; without the pool, batches run on the calling process
+            concurrency = pool_workers() if settings.FACE_POOL_ENABLED else 1
+            _batchers[model_name] = EmbeddingBatcher(
+                model_name,
+                runner=embed_batch,
+                window=settings.FACE_BATCH_WINDOW_MS / 1000,
+                max_batch=settings.FACE_BATCH_MAX_SIZE,
+                concurrency=concurrency,
+            )
+        return _batchers[model_name]
@@ -0,0 +1,377 @@
+"""
+Face embedding helpers shared by verify_face and the profile avatar upload.
+
+Avatar embeddings are computed once when the avatar is saved and stored in
+``User.face_encoding`` so that verification only has to embed the captured
+frame. The stored value is a small JSON document::
+
+    {"version": 1, "pipeline": "deepface+crop", "avatar": "avatars/me.jpg",
+     "models": {"Facenet512": "<base64 float16>", "VGG-Face": "..."},
+     "average_hash": "<hex>", "pixels_file": "face_pixels/avatars/me.jpg.npy"}
+
+``average_hash`` and the 200x200 grayscale pixels saved in ``pixels_file``
+(next to the avatar in media storage, as the column is loaded with every
+user) feed the imagehash and pixel fallbacks used where DeepFace is not
+installed.
+
+Users can also enroll extra ``ReferencePhoto``s. Each photo keeps its own
+``{"version", "pipeline", "models"}`` document, and the user's document
+gets a ``"gallery": {"photos": [ids], "models": {name: <base64 float16
+rows>}}`` entry stacking them, so verification compares a frame with the
+avatar and every reference photo in one matrix product. Only photos
+showing the same face as the avatar are enrolled and stacked, so the
+gallery cannot vouch for somebody else.
+
+With ``FACE_STORE_ENABLED`` the vectors are also written to the quantized
+on-disk store (see ``store.py``) and read back from its memory map, so
+lookups skip the JSON and base64 decoding.
+"""
+import base64
+import io
+import json
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the way embeddings are produced changes, so stored encodings
+# are recomputed instead of being compared against incompatible vectors.
+ENCODING_VERSION = 1
+
+
+def get_embedding(image, model_name):
+    """Embed an image path or BGR array with the configured backend"""
+    from .backends import get_backend
+    return get_backend().embed(image, model_name)
+
+
+def get_embeddings(images, model_name):
+    """Embed several images with one batched forward pass through the model"""
+    from .backends import get_backend
+    return get_backend().embed_batch(images, model_name)
+
+
+def cosine_similarity(a, b):
+    import numpy as np
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def encode_vector(vector):
+    import numpy as np
+    return base64.b64encode(np.asarray(vector, dtype=np.float16).tobytes()).decode('ascii')
+
+
+def decode_vector(data):
+    import numpy as np
+    return np.frombuffer(base64.b64decode(data), dtype=np.float16).astype(np.float32)
+
+
+def pipeline_tag():
+    """Identify how embeddings are produced; vectors from different pipelines are not compared"""
+    return settings.FACE_EMBEDDING_BACKEND + ('+crop' if settings.FACE_PREPROCESS else '')
+
+
+def image_input(path):
+    """An enrollment image as fed to the embedding backends"""
+    if settings.FACE_PREPROCESS:
+        from .preprocessing import prepare
+        return prepare(path).image
+    return path
+
+
+def avatar_input(user):
+    return image_input(user.avatar.path)
+
+
+def configured_models():
+    """FACE_MODELS plus the load-shedding FACE_DEGRADE_MODEL, if set"""
+    models = list(settings.FACE_MODELS)
+    if settings.FACE_DEGRADE_MODEL and settings.FACE_DEGRADE_MODEL not in models:
+        models.append(settings.FACE_DEGRADE_MODEL)
+    return models
+
+
+def _load_encoding(user):
+    """Return the stored encoding document, or None if missing or stale"""
+    if not user.avatar or not user.face_encoding:
+        return None
+    try:
+        data = json.loads(user.face_encoding)
+    except ValueError:
+        return None
+    if (data.get('version') != ENCODING_VERSION
+            or data.get('pipeline') != pipeline_tag()
+            or data.get('avatar') != user.avatar.name):
+        return None
+    return data
+
+
+def _empty_encoding(user):
+    return {
+        'version': ENCODING_VERSION,
+        'pipeline': pipeline_tag(),
+        'avatar': user.avatar.name,
+        'models': {},
+    }
+
+
+def avatar_tag(user):
+    """Identify the avatar and the pipeline its embeddings were computed with"""
+    return f'{ENCODING_VERSION}:{pipeline_tag()}:{user.avatar.name}'
+
+
+def stored_embedding(user, model_name):
+    """The stored avatar embedding for model_name, or None if there is none"""
+    if settings.FACE_STORE_ENABLED and user.avatar:
+        from .store import get_store
+        embedding = get_store(model_name).get(user.pk, avatar_tag(user))
+        if embedding is not None:
+            return embedding
+    data = _load_encoding(user)
+    if data and model_name in data['models']:
+        return decode_vector(data['models'][model_name])
+    return None
+
+
+def _dump_encoding(data):
+    if not data or not (data['models'] or 'pixels_file' in data or data.get('gallery')):
+        return None
+    return json.dumps(data)
+
+
+def _save_encoding(user, data):
+    user.face_encoding = _dump_encoding(data)
+    if user.pk is None:
+        # An unsaved user, e.g. from benchmark_face; keep the encoding on the instance only
+        return
+    user.save(update_fields=['face_encoding'])
+    if settings.FACE_STORE_ENABLED:
+        sync_store(user)
+    if settings.FACE_DUPLICATE_CHECK:
+        from .index import update_user
+        update_user(user)
+
+
+def sync_store(user):
+    """Write the user's stored embeddings to the on-disk store, dropping stale ones"""
+    from .store import get_store
+
+    data = _load_encoding(user) or {'models': {}}
+    for model_name in configured_models():
+        store = get_store(model_name)
+        if model_name in data['models']:
+            store.put(user.pk, decode_vector(data['models'][model_name]), avatar_tag(user))
+        else:
+            store.remove(user.pk)
+
+
+def _pixels_name(user):
+    return f'face_pixels/{user.avatar.name}.npy'
+
+
+def avatar_fallbacks(user):
+    """Average hash and saved grayscale pixels of the avatar for the non-DeepFace matchers"""
+    import numpy as np
+    from PIL import Image
+    from .verification import gray_pixels, hash_image
+
+    with Image.open(user.avatar.path) as image:
+        image.load()
+    buffer = io.BytesIO()
+    np.save(buffer, gray_pixels(image))
+    storage, name = user.avatar.storage, _pixels_name(user)
+    if storage.exists(name):
+        storage.delete(name)
+    fallbacks = {'pixels_file': storage.save(name, ContentFile(buffer.getvalue()))}
+    try:
+        import imagehash
+    except ImportError:
+        pass
+    else:
+        fallbacks['average_hash'] = str(imagehash.average_hash(hash_image(image)))
+    return fallbacks
+
+
+def _embed_image(path, label):
+    """Embed an image with every configured model; models that fail are left out"""
+    from .pool import embed
+
+    models, image = {}, None
+    for model_name in configured_models():
+        try:
+            if image is None:
+                image = image_input(path)
+            models[model_name] = encode_vector(embed(image, model_name))
+        except ImportError:
+            break
+        except Exception as e:
+            logger.warning("Could not embed %s with %s: %s", label, model_name, e)
+    return models
+
+
+def refresh_avatar_encoding(user, save=True):
+    """Recompute the stored embeddings for the user's current avatar.
+
+    Models that fail (or a missing DeepFace install) are simply left out;
+    verify_face computes and stores them lazily on first use.
+    """
+    data = None
+    if user.avatar:
+        data = _empty_encoding(user)
+        try:
+            data.update(avatar_fallbacks(user))
+        except Exception as e:
+            logger.warning("Could not hash avatar of user %s: %s", user.pk, e)
+        data['models'] = _embed_image(user.avatar.path, f'avatar of user {user.pk}')
+        data['gallery'] = _build_gallery(user, data['models'])
+
+    if save:
+        _save_encoding(user, data)
+    else:
+        user.face_encoding = _dump_encoding(data)
+    return user.face_encoding
+
+
+def get_avatar_embedding(user, model_name):
+    """Return the avatar embedding for model_name, computing and storing it on a miss"""
+    from .pool import embed
+
+    embedding = stored_embedding(user, model_name)
+    if embedding is not None:
+        return embedding
+
+    embedding = embed(avatar_input(user), model_name)
+    data = _load_encoding(user) or _empty_encoding(user)
+    data['models'][model_name] = encode_vector(embedding)
+    _save_encoding(user, data)
+    return embedding
+
+
+def _stored_fallback(user, data, key):
+    if key != 'pixels':
+        return data.get(key)
+    if 'pixels_file' not in data:
+        return None
+    import numpy as np
+    try:
+        with user.avatar.storage.open(data['pixels_file']) as handle:
+            return np.load(handle)
+    except FileNotFoundError:
+        return None
+
+
+def get_avatar_fallback(user, key):
+    """Return the stored 'average_hash' or 'pixels' of the avatar, computing them on a miss"""
+    data = _load_encoding(user)
+    value = _stored_fallback(user, data, key) if data else None
+    if value is None:
+        data = data or _empty_encoding(user)
+        data.pop('pixels', None)  # inlined by earlier versions
+        data.update(avatar_fallbacks(user))
+        _save_encoding(user, data)
+        value = _stored_fallback(user, data, key)
+    return value
+
+
+def _photo_models(photo):
+    """Stored embeddings of a reference photo, or None if missing or stale"""
+    if not photo.face_encoding:
+        return None
+    try:
+        data = json.loads(photo.face_encoding)
+    except ValueError:
+        return None
+    if data.get('version') != ENCODING_VERSION or data.get('pipeline') != pipeline_tag():
+        return None
+    return data['models']
+
+
+def refresh_photo_encoding(photo):
+    photo.face_encoding = json.dumps({
+        'version': ENCODING_VERSION,
+        'pipeline': pipeline_tag(),
+        'models': _embed_image(photo.image.path, f'reference photo {photo.pk}'),
+    })
+    photo.save(update_fields=['face_encoding'])
+
+
+def _same_face(models, avatar_models):
+    """Whether encoded embeddings match the avatar's, by the first of FACE_MODELS both have"""
+    for model_name in settings.FACE_MODELS:
+        if model_name in models and model_name in avatar_models:
+            similarity = cosine_similarity(decode_vector(models[model_name]), decode_vector(avatar_models[model_name]))
+            return similarity > settings.FACE_MATCH_THRESHOLD
+    return False
+
+
+def photo_matches_avatar(photo):
+    """Whether an embedded reference photo shows the face of its user's avatar.
+
+    None when the two could not be compared: no model embedded both, e.g.
+    without DeepFace, with the inference pool busy or when a model failed.
+    """
+    models = _photo_models(photo) or {}
+    for model_name in settings.FACE_MODELS:
+        if model_name not in models:
+            continue
+        try:
+            avatar = get_avatar_embedding(photo.user, model_name)
+        except Exception as e:
+            logger.warning("Could not embed avatar of user %s with %s: %s", photo.user_id, model_name, e)
+            continue
+        return cosine_similarity(decode_vector(models[model_name]), avatar) > settings.FACE_MATCH_THRESHOLD
+    return None
+
+
+def _build_gallery(user, avatar_models):
+    """Stack the stored embeddings of the reference photos matching the avatar, per model"""
+    import numpy as np
+
+    photos, rows = [], {}
+    for photo in user.reference_photos.all():
+        models = _photo_models(photo)
+        if not models:
+            continue
+        if not _same_face(models, avatar_models):
+            # E.g. enrolled against a previous avatar
+            continue
+        photos.append(photo.pk)
+        for model_name, vector in models.items():
+            rows.setdefault(model_name, []).append(decode_vector(vector))
+    return {
+        'photos': photos,
+        'models': {model_name: encode_vector(np.stack(vectors)) for model_name, vectors in rows.items()},
+    }
+
+
+def refresh_gallery(user):
+    """Embed reference photos that have no current embeddings and restack the gallery"""
+    for photo in user.reference_photos.all():
+        if _photo_models(photo) is None:
+            refresh_photo_encoding(photo)
+    if not user.avatar:
+        # The gallery lives in the avatar's encoding document; it is stacked when one is uploaded
+        return
+    data = _load_encoding(user) or _empty_encoding(user)
+    data['gallery'] = _build_gallery(user, data['models'])
+    _save_encoding(user, data)
+
+
+def gallery_version(user):
+    """Ids of the reference photos in the user's stored gallery"""
+    data = _load_encoding(user)
+    return ','.join(str(pk) for pk in data.get('gallery', {}).get('photos', [])) if data else ''
+
+
+def get_references(user, model_name):
+    """Matrix of the avatar embedding followed by every reference photo embedding"""
+    import numpy as np
+
+    rows = [get_avatar_embedding(user, model_name)]
+    data = _load_encoding(user)
+    gallery = data.get('gallery', {}).get('models', {}) if data else {}
+    if model_name in gallery:
+        rows.append(decode_vector(gallery[model_name]).reshape(-1, len(rows[0])))
+    return np.vstack(rows)
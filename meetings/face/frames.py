@@ -0,0 +1,124 @@
+"""
+Captured frames for face verification.
+
+A ``Frame`` holds the uploaded JPEG bytes and decodes them lazily, at most
+once per representation, so the embedding, imagehash and pixel matchers
+all share the same decoded image.
+"""
+import base64
+import hashlib
+import io
+import json
+from functools import cached_property
+
+from django.conf import settings
+
+
+def burst_digest(frames, method):
+    """Identify a burst by its frames' bytes, in any order, and how their scores are aggregated"""
+    digests = sorted(frame.digest for frame in frames)
+    return hashlib.sha256(':'.join([method] + digests).encode()).hexdigest()
+
+
+class Frame:
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def from_request(cls, request):
+        """Read the frame from a raw, multipart or JSON data-URL upload.
+
+        Returns None when the request carries no image.
+        """
+        content_type = request.content_type or ''
+        if content_type == 'application/octet-stream' or content_type.startswith('image/'):
+            data = request.body
+        elif content_type.startswith('multipart/'):
+            upload = request.FILES.get('face_image')
+            data = upload.read() if upload else None
+        else:
+            face_image_data = json.loads(request.body).get('face_image')
+            data = cls.decode_data_url(face_image_data) if face_image_data else None
+        return cls(data) if data else None
+
+    @classmethod
+    def list_from_request(cls, request):
+        """Read a burst of frames from multipart ``face_images`` files or a JSON list of data URLs"""
+        content_type = request.content_type or ''
+        if content_type.startswith('multipart/'):
+            images = [upload.read() for upload in request.FILES.getlist('face_images')]
+        else:
+            images = [cls.decode_data_url(value) for value in json.loads(request.body).get('face_images') or []]
+        return [cls(data) for data in images if data]
+
+    @classmethod
+    def list_from_bytes(cls, data):
+        """Split a message of frames, each prefixed with its length as a 4-byte big-endian integer"""
+        frames, offset = [], 0
+        while offset < len(data):
+            if offset + 4 > len(data):
+                raise ValueError('Truncated frame header')
+            size = int.from_bytes(data[offset:offset + 4], 'big')
+            offset += 4
+            if not size or offset + size > len(data):
+                raise ValueError('Truncated frame')
+            frames.append(cls(data[offset:offset + size]))
+            offset += size
+        return frames
+
+    @staticmethod
+    def decode_data_url(value):
+        return base64.b64decode(value.split(',')[1] if ',' in value else value)
+
+    @cached_property
+    def digest(self):
+        """SHA-256 of the image bytes, identifying exact replays"""
+        return hashlib.sha256(self.data).hexdigest()
+
+    @cached_property
+    def bgr(self):
+        """OpenCV BGR array"""
+        import cv2
+        import numpy as np
+
+        return cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR)
+
+    @cached_property
+    def face(self):
+        """Downscaled face crop from the preprocessing stage"""
+        from .preprocessing import prepare
+
+        return prepare(self.bgr)
+
+    @cached_property
+    def embedding_input(self):
+        """What the embedding backends are fed for this frame"""
+        return self.face.image if settings.FACE_PREPROCESS else self.bgr
+
+    @cached_property
+    def pil(self):
+        """PIL image"""
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(self.data))
+        image.load()
+        return image
+
+    @cached_property
+    def face_hash(self):
+        """64-bit average hash of the face crop, as imagehash.average_hash computes it.
+
+        None when no face was found. A hash of the whole frame is dominated
+        by the background and hardly changes when someone else takes the seat.
+        """
+        import cv2
+        import numpy as np
+        from PIL import Image
+
+        if self.bgr is None or self.face.box is None:
+            return None
+        face = self.face.image
+        gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY) if face.ndim == 3 else face
+        pixels = np.asarray(Image.fromarray(gray).resize((8, 8), Image.LANCZOS), dtype=np.float32)
+        bits = (pixels > pixels.mean()).flatten()
+        return int(''.join('1' if bit else '0' for bit in bits), 2)
@@ -0,0 +1,81 @@
+"""
+Perceptual-hash change gate in front of the embedding pipeline.
+
+A lobby retry or a periodic in-room check from a candidate sitting still
+sends frames that are perceptually identical to the last one. For each
+key (user + session in the lobby, the socket in the meeting room) the
+gate remembers the average hash of the face crop of the last verified
+frame and its result. A new frame whose face is within
+``FACE_GATE_DISTANCE`` bits reuses that result instead of running
+inference; frames without a detected face always go through. A lobby burst is reused when each of its
+frames is that close to one of the frames of the last burst. Hits and
+misses are counted so the threshold can be tuned.
+"""
+import collections
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+_lock = threading.Lock()
+_counts = collections.Counter()
+
+
+def _count(key):
+    with _lock:
+        _counts[key] += 1
+
+
+def hash_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def check(key, frame):
+    """Return the remembered result if the frame matches the last one for key"""
+    if not settings.FACE_GATE_ENABLED or frame.face_hash is None:
+        return None
+    remembered = cache.get(f'face_gate:{key}')
+    if remembered is not None:
+        frame_hash, result = remembered
+        if hash_distance(frame_hash, frame.face_hash) <= settings.FACE_GATE_DISTANCE:
+            _count('hits')
+            return result
+    _count('misses')
+    return None
+
+
+def remember(key, frame, result):
+    if settings.FACE_GATE_ENABLED and frame.face_hash is not None:
+        cache.set(f'face_gate:{key}', (frame.face_hash, result), settings.FACE_GATE_TTL)
+
+
+def check_burst(key, frames):
+    """Return the remembered result if every frame matches one of the last burst's for key"""
+    if not settings.FACE_GATE_ENABLED or any(frame.face_hash is None for frame in frames):
+        return None
+    remembered = cache.get(f'face_gate:{key}')
+    if remembered is not None:
+        hashes, result = remembered
+        if all(
+            any(hash_distance(frame_hash, frame.face_hash) <= settings.FACE_GATE_DISTANCE for frame_hash in hashes)
+            for frame in frames
+        ):
+            _count('hits')
+            return result
+    _count('misses')
+    return None
+
+
+def remember_burst(key, frames, result):
+    if settings.FACE_GATE_ENABLED and all(frame.face_hash is not None for frame in frames):
+        cache.set(f'face_gate:{key}', ([frame.face_hash for frame in frames], result), settings.FACE_GATE_TTL)
+
+
+def stats():
+    with _lock:
+        hits, misses = _counts['hits'], _counts['misses']
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+    }
@@ -0,0 +1,262 @@
+"""
+In-memory 1:N index of avatar embeddings.
+
+Each model gets a ``FaceIndex``: the L2-normalised avatar embeddings of
+every user are kept in one contiguous float32 matrix, so a top-k cosine
+search is a single matrix-vector product. The index is built from the
+embeddings stored in ``User.face_encoding`` and updated incrementally when
+an avatar is re-embedded in this process. Every ``FACE_INDEX_MAX_AGE``
+seconds it is rebuilt in a background thread, to pick up changes made by
+other workers, and swapped in when done; searches keep using the current
+index meanwhile. ``find_duplicate_faces --save`` writes it to
+``FACE_INDEX_DIR``, where workers memory-map it read-only instead of
+building their own copy, and map it again whenever it is re-saved.
+With ``FACE_STORE_ENABLED`` the index is built from the quantized
+embedding store in one pass instead of decoding every user's JSON.
+"""
+import logging
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class FaceIndex:
+    def __init__(self, model_name, dim=None):
+        import numpy as np
+
+        self.model_name = model_name
+        self.dim = dim
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, dim or 0), dtype=np.float32)
+        self._size = 0
+        self._positions = {}
+        self._lock = threading.Lock()
+        self.built_at = time.monotonic()
+        self.saved_mtime = None  # of the FACE_INDEX_DIR file this index maps, if any
+
+    def __len__(self):
+        return self._size
+
+    def _ensure_writable(self):
+        import numpy as np
+
+        if not self._matrix.flags.writeable:
+            # First write after loading a read-only memory map
+            self._matrix = np.array(self._matrix)
+            self._ids = np.array(self._ids)
+
+    def _ensure_capacity(self, dim):
+        import numpy as np
+
+        if self.dim is None:
+            self.dim = dim
+            self._matrix = np.empty((0, dim), dtype=np.float32)
+        if dim != self.dim:
+            raise ValueError(f'{self.model_name} index holds {self.dim}-d vectors, got {dim}-d')
+        self._ensure_writable()
+        if self._size == len(self._matrix):
+            capacity = max(1024, 2 * len(self._matrix))
+            matrix = np.empty((capacity, dim), dtype=np.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+            ids = np.empty(capacity, dtype=np.int64)
+            ids[:self._size] = self._ids[:self._size]
+            self._matrix, self._ids = matrix, ids
+
+    def add(self, user_id, embedding):
+        """Insert or replace the embedding of a user"""
+        import numpy as np
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            self._ensure_capacity(len(vector))
+            position = self._positions.get(user_id)
+            if position is None:
+                position = self._size
+                self._size += 1
+                self._positions[user_id] = position
+                self._ids[position] = user_id
+            self._matrix[position] = vector
+
+    def remove(self, user_id):
+        with self._lock:
+            position = self._positions.pop(user_id, None)
+            if position is None:
+                return
+            self._ensure_writable()
+            last = self._size - 1
+            if position != last:
+                # Move the last row into the hole to keep the matrix contiguous
+                self._matrix[position] = self._matrix[last]
+                self._ids[position] = self._ids[last]
+                self._positions[int(self._ids[position])] = position
+            self._size = last
+
+    def search(self, embedding, k=5, exclude=None):
+        """Return up to k (user_id, cosine similarity) pairs, best first"""
+        import numpy as np
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            if not self._size or len(query) != self.dim:
+                return []
+            scores = self._matrix[:self._size] @ query
+            ids = self._ids[:self._size]
+            if exclude is not None and exclude in self._positions:
+                scores = scores.copy()
+                scores[self._positions[exclude]] = -np.inf
+            k = min(k, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def duplicate_pairs(self, threshold, chunk_size=256):
+        """Yield (user_id, other_id, similarity) for every pair above threshold"""
+        import numpy as np
+
+        with self._lock:
+            matrix = self._matrix[:self._size]
+            ids = self._ids[:self._size].copy()
+        # Score a block of rows against the whole matrix at a time to bound memory
+        for start in range(0, len(ids), chunk_size):
+            scores = matrix[start:start + chunk_size] @ matrix.T
+            rows, cols = np.nonzero(scores > threshold)
+            for row, col in zip(rows, cols):
+                if start + row < col:
+                    yield int(ids[start + row]), int(ids[col]), float(scores[row, col])
+
+    def save(self, directory):
+        import numpy as np
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            np.save(directory / f'{self.model_name}.vectors.npy', self._matrix[:self._size])
+            np.save(directory / f'{self.model_name}.ids.npy', self._ids[:self._size])
+
+    @classmethod
+    def load(cls, directory, model_name, mmap=True):
+        import numpy as np
+
+        directory = Path(directory)
+        matrix = np.load(directory / f'{model_name}.vectors.npy', mmap_mode='r' if mmap else None)
+        ids = np.load(directory / f'{model_name}.ids.npy')
+        index = cls(model_name, dim=matrix.shape[1])
+        index._matrix, index._ids, index._size = matrix, ids, len(ids)
+        index._positions = {int(user_id): position for position, user_id in enumerate(ids)}
+        return index
+
+    @classmethod
+    def from_vectors(cls, model_name, ids, matrix):
+        import numpy as np
+
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        index = cls(model_name, dim=matrix.shape[1])
+        index._matrix = matrix / np.where(norms == 0, 1.0, norms)
+        index._ids, index._size = np.asarray(ids, dtype=np.int64), len(ids)
+        index._positions = {int(user_id): position for position, user_id in enumerate(ids)}
+        return index
+
+    @classmethod
+    def build(cls, model_name):
+        """Build the index from the embeddings stored on every user"""
+        from django.contrib.auth import get_user_model
+        from .embeddings import stored_embedding
+
+        if settings.FACE_STORE_ENABLED:
+            from .store import get_store
+            ids, matrix = get_store(model_name).vectors()
+            if matrix is not None:
+                return cls.from_vectors(model_name, ids, matrix)
+
+        index = cls(model_name)
+        users = get_user_model().objects.exclude(face_encoding__isnull=True).exclude(face_encoding='')
+        for user in users.only('id', 'avatar', 'face_encoding').iterator(chunk_size=2000):
+            embedding = stored_embedding(user, model_name)
+            if embedding is not None:
+                index.add(user.pk, embedding)
+        return index
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_refreshing = set()
+
+
+def _saved_mtime(model_name):
+    try:
+        return (Path(settings.FACE_INDEX_DIR) / f'{model_name}.vectors.npy').stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _load_or_build(model_name, current=None):
+    """Map the saved index, or build one if there is none; None if current is still up to date"""
+    mtime = _saved_mtime(model_name)
+    if mtime is not None:
+        if current is not None and current.saved_mtime == mtime:
+            return None
+        index = FaceIndex.load(settings.FACE_INDEX_DIR, model_name)
+        index.saved_mtime = mtime
+        return index
+    return FaceIndex.build(model_name)
+
+
+def _refresh(model_name, current):
+    from django.db import connection
+
+    try:
+        index = _load_or_build(model_name, current)
+        with _indexes_lock:
+            if index is not None:
+                _indexes[model_name] = index
+            else:
+                current.built_at = time.monotonic()
+    except Exception:
+        logger.exception("Could not refresh the %s face index", model_name)
+    finally:
+        connection.close()
+        with _indexes_lock:
+            _refreshing.discard(model_name)
+
+
+def get_index(model_name):
+    with _indexes_lock:
+        index = _indexes.get(model_name)
+        if index is not None:
+            if (time.monotonic() - index.built_at > settings.FACE_INDEX_MAX_AGE
+                    and model_name not in _refreshing):
+                _refreshing.add(model_name)
+                threading.Thread(
+                    target=_refresh, args=(model_name, index), name=f'face-index-{model_name}', daemon=True
+                ).start()
+            return index
+
+    # Only the first search of a model in this process waits for the index
+    index = _load_or_build(model_name)
+    with _indexes_lock:
+        return _indexes.setdefault(model_name, index)
+
+
+def update_user(user):
+    """Refresh a user's rows in the already-built indexes of this process"""
+    from .embeddings import stored_embedding
+
+    for model_name, index in list(_indexes.items()):
+        embedding = stored_embedding(user, model_name)
+        if embedding is None:
+            index.remove(user.pk)
+        else:
+            index.add(user.pk, embedding)
+
+
+def find_duplicates(user, embedding, model_name, k=None):
+    """Other users whose avatar matches the embedding above FACE_MATCH_THRESHOLD"""
+    results = get_index(model_name).search(embedding, k=k or settings.FACE_INDEX_TOP_K, exclude=user.pk)
+    return [(user_id, score) for user_id, score in results if score > settings.FACE_MATCH_THRESHOLD]
@@ -0,0 +1,137 @@
+"""
+Load-aware admission for face verification.
+
+Before running inference, verify_face asks ``admit()`` how loaded this
+worker is. The signals are the queue depth - the inference pool's queue
+(or, without the pool, the verifications in flight in this process) plus
+the socket jobs waiting for a concurrency slot (``queued()``) - and the p95
+latency of verifications finished in the last ``FACE_LOAD_WINDOW``
+seconds, once there are ``FACE_LOAD_MIN_SAMPLES`` of them. Verifications
+that started before a model's first one in this process finished are
+cold starts, waiting for the model to load, and are not sampled. Past the ``FACE_DEGRADE_*`` limits the request runs on the
+cheaper ``FACE_DEGRADE_MODEL``; past the ``FACE_SHED_*`` limits it is
+answered at once with a 503 and ``Retry-After``. Each decision is
+counted so ``face/ready`` shows how often the policy triggers.
+"""
+import collections
+import contextlib
+import threading
+import time
+
+from django.conf import settings
+
+from .pool import percentile_ms
+
+NORMAL = 'normal'
+DEGRADED = 'degraded'
+SHED = 'shed'
+
+_lock = threading.Lock()
+_counts = collections.Counter()
+_samples = collections.deque(maxlen=1000)  # (finished at, seconds)
+_in_flight = 0
+_waiting = 0
+_warm = set()  # models with a finished verification in this process
+
+
+def _recent_latencies():
+    cutoff = time.monotonic() - settings.FACE_LOAD_WINDOW
+    with _lock:
+        while _samples and _samples[0][0] < cutoff:
+            _samples.popleft()
+        return [seconds for _, seconds in _samples]
+
+
+def queue_depth():
+    """Requests waiting for inference in this worker"""
+    from .pool import metrics
+
+    pool_metrics = metrics()
+    with _lock:
+        if pool_metrics is not None:
+            return pool_metrics['queue_depth'] + _waiting
+        # Without the pool, verifications run in request threads; count the ones beyond the first
+        return max(0, _in_flight - 1) + _waiting
+
+
+@contextlib.contextmanager
+def queued():
+    """Count a verification waiting for a concurrency slot towards the queue depth"""
+    global _waiting
+    with _lock:
+        _waiting += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _waiting -= 1
+
+
+def decide():
+    """The decision admit() would make right now, without counting it"""
+    depth = queue_depth()
+    latencies = _recent_latencies()
+    # A handful of samples (say, one slow request) says nothing about load
+    p95 = percentile_ms(latencies, 95) if len(latencies) >= settings.FACE_LOAD_MIN_SAMPLES else 0
+
+    if depth >= settings.FACE_SHED_QUEUE_DEPTH or p95 >= settings.FACE_SHED_LATENCY_MS:
+        decision = SHED
+    elif settings.FACE_DEGRADE_MODEL and (
+            depth >= settings.FACE_DEGRADE_QUEUE_DEPTH or p95 >= settings.FACE_DEGRADE_LATENCY_MS):
+        decision = DEGRADED
+    else:
+        decision = NORMAL
+    return decision
+
+
+def admit():
+    """Return NORMAL, DEGRADED or SHED for a new verification"""
+    decision = decide()
+    with _lock:
+        _counts[decision] += 1
+    return decision
+
+
+def shedding():
+    """Whether a request would be turned away right now; if so it is counted as shed"""
+    if decide() != SHED:
+        return False
+    with _lock:
+        _counts[SHED] += 1
+    return True
+
+
+@contextlib.contextmanager
+def track(model_name=None):
+    """Count a verification as in flight and record how long it took, unless it was a cold start"""
+    global _in_flight
+    with _lock:
+        _in_flight += 1
+        cold = model_name not in _warm
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        end = time.monotonic()
+        with _lock:
+            _in_flight -= 1
+            if cold:
+                _warm.add(model_name)
+            else:
+                _samples.append((end, end - start))
+
+
+def stats():
+    latencies = _recent_latencies()
+    with _lock:
+        counts = dict(_counts)
+        in_flight = _in_flight
+        waiting = _waiting
+    return {
+        'in_flight': in_flight,
+        'waiting': waiting,
+        'p95_ms': percentile_ms(latencies, 95),
+        'normal': counts.get(NORMAL, 0),
+        'degraded': counts.get(DEGRADED, 0),
+        'shed': counts.get(SHED, 0),
+    }
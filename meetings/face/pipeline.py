@@ -0,0 +1,144 @@
+"""
+The verify_face request pipeline, shared by the HTTP views and the
+verification WebSocket consumer.
+
+A frame goes through the exact-replay result cache, the quality
+pre-screen, the perceptual change gate and load-aware admission before
+inference. Requests that cannot be verified raise ``Rejected`` with the
+payload and status to answer with. ``progress(stage)`` is called as the
+pipeline moves on, so callers can report it.
+"""
+from django.conf import settings
+
+from .pool import InferenceUnavailable
+
+NO_AVATAR = 'Please upload a profile photo first. Go to your profile to add one.'
+BUSY = 'Face verification is busy, please try again shortly.'
+
+
+class Rejected(Exception):
+    def __init__(self, payload, status, retry_after=None):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+        self.status = status
+        self.retry_after = retry_after
+
+
+def busy(message=BUSY):
+    """The client should retry after FACE_RETRY_AFTER seconds instead of queueing"""
+    return Rejected({'success': False, 'busy': True, 'error': message}, 503, settings.FACE_RETRY_AFTER)
+
+
+def quality_rejection(reason):
+    from .quality import MESSAGES
+    return Rejected({'success': False, 'matched': False, 'reason': reason, 'error': MESSAGES[reason]}, 422)
+
+
+def require_avatar(user):
+    if not user.avatar:
+        raise Rejected({'success': False, 'matched': False, 'error': NO_AVATAR}, 400)
+
+
+def _noop(stage):
+    pass
+
+
+def _admit():
+    """Return the model override for this request, or raise busy() when shedding"""
+    from . import load
+
+    decision = load.admit()
+    if decision == load.SHED:
+        raise busy()
+    return settings.FACE_DEGRADE_MODEL if decision == load.DEGRADED else None
+
+
+def verify_frame(user, frame, session_key, progress=_noop):
+    from . import gate, load, results
+    from .quality import assess
+    from .verification import verify
+
+    require_avatar(user)
+
+    # A replay of the exact same frame is answered from the result cache
+    result = results.get(user, frame.digest)
+    if result is not None:
+        return {**result, 'cached': True}
+
+    # Dark, blurred or faceless frames are rejected before any inference
+    if settings.FACE_QUALITY_CHECK:
+        progress('quality')
+        reason = assess(frame)
+        if reason is not None:
+            raise quality_rejection(reason)
+
+    # A retry with a perceptually identical frame gets the previous answer
+    gate_key = f'{user.pk}:{session_key}:{user.avatar.name}'
+    result = gate.check(gate_key, frame)
+    if result is not None:
+        return {**result, 'reused': True, 'cached': False}
+
+    # Under load, switch to the cheaper model or turn the request away right now
+    model_name = _admit()
+    progress('matching')
+    try:
+        with load.track(model_name):
+            result = verify(user, frame, model_name)
+    except InferenceUnavailable as e:
+        raise busy(str(e))
+    if model_name:
+        # Not remembered, so a retry once load drops gets the full model
+        return {**result, 'degraded': True, 'cached': False}
+    gate.remember(gate_key, frame, result)
+    results.remember(user, frame.digest, result)
+    return {**result, 'cached': False}
+
+
+def verify_frames(user, frames, method, session_key, progress=_noop):
+    from . import gate, load, results
+    from .frames import burst_digest
+    from .quality import assess
+    from .verification import verify_burst
+
+    if len(frames) > settings.FACE_BURST_MAX_FRAMES:
+        raise Rejected({
+            'success': False,
+            'error': f'At most {settings.FACE_BURST_MAX_FRAMES} frames can be sent at once'
+        }, 400)
+    if method not in ('median', 'best_k'):
+        raise Rejected({'success': False, 'error': 'aggregate must be median or best_k'}, 400)
+    require_avatar(user)
+
+    # A replay of the exact same burst is answered from the result cache
+    digest = burst_digest(frames, method)
+    result = results.get(user, digest)
+    if result is not None:
+        return {**result, 'cached': True}
+
+    # Only usable frames are embedded; if none is, report why the first one failed
+    if settings.FACE_QUALITY_CHECK:
+        progress('quality')
+        reasons = [assess(frame) for frame in frames]
+        usable = [frame for frame, reason in zip(frames, reasons) if reason is None]
+        if not usable:
+            raise quality_rejection(reasons[0])
+        frames = usable
+
+    # A retry with a perceptually identical burst gets the previous answer
+    gate_key = f'{user.pk}:{session_key}:{user.avatar.name}:burst:{method}'
+    result = gate.check_burst(gate_key, frames)
+    if result is not None:
+        return {**result, 'reused': True, 'cached': False}
+
+    model_name = _admit()
+    progress('matching')
+    try:
+        with load.track(model_name):
+            result = verify_burst(user, frames, method, model_name)
+    except InferenceUnavailable as e:
+        raise busy(str(e))
+    if model_name:
+        return {**result, 'degraded': True, 'cached': False}
+    gate.remember_burst(gate_key, frames, result)
+    results.remember(user, digest, result)
+    return {**result, 'cached': False}
@@ -0,0 +1,252 @@
+"""
+Out-of-process pool for face inference.
+
+With ``FACE_POOL_ENABLED`` the TensorFlow work for verify_face runs in a
+dedicated process pool instead of the request thread, so a slow embedding
+no longer pins a web worker. Submissions beyond ``workers + queue size``
+are rejected immediately with ``QueueFull`` and callers wait at most
+``FACE_POOL_TIMEOUT`` seconds for a result. If a pool process dies (OOM
+kill, native crash) the jobs it took down fail with ``InferenceCrashed``
+and the next submission starts a fresh pool, which the warm-up brings up
+again in the background.
+
+Pool processes are started on demand, so ``start()`` (called by the
+warm-up) submits one job per worker that waits on a shared barrier: the
+jobs can only meet there once every process is up and has run its
+initializer, which loads the models.
+"""
+import collections
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+
+class InferenceUnavailable(Exception):
+    """The pool cannot serve the request right now; the client should retry"""
+
+
+class QueueFull(InferenceUnavailable):
+    pass
+
+
+class InferenceTimeout(InferenceUnavailable):
+    pass
+
+
+class InferenceCrashed(InferenceUnavailable):
+    pass
+
+
+def _init_worker(model_names):
+    # Load the weights once per pool process so jobs only pay for inference
+    from .backends import get_backend
+
+    backend = get_backend()
+    for model_name in model_names:
+        try:
+            backend.warm_up(model_name)
+        except ImportError:
+            return
+        except Exception:
+            pass
+
+
+def _started_job(barrier, timeout):
+    # Jobs run after the initializer, and each waits here until all workers hold one
+    barrier.wait(timeout)
+    return os.getpid()
+
+
+def _embed_job(image, model_name):
+    from .embeddings import get_embedding
+    return get_embedding(image, model_name)
+
+
+def _embed_batch_job(images, model_name):
+    from .embeddings import get_embeddings
+    return get_embeddings(images, model_name)
+
+
+def percentile_ms(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index] * 1000, 1)
+
+
+class InferencePool:
+    def __init__(self, workers=None, queue_size=32, timeout=15.0, model_names=()):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.model_names = list(model_names)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self._pending = 0
+        self._latencies = collections.deque(maxlen=500)
+        self._counts = collections.Counter()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: TensorFlow is not fork-safe once loaded in the parent
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.model_names,),
+                )
+            return self._executor
+
+    def _discard(self, executor):
+        """Drop a broken executor so the next submission starts new processes.
+
+        Returns True for the first caller to notice, which restarts the warm-up.
+        """
+        with self._lock:
+            discarded = self._executor is executor
+            if discarded:
+                self._executor = None
+            self._counts['crashes'] += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+        return discarded
+
+    def _restart(self, executor):
+        if self._discard(executor):
+            from .warmup import rewarm
+            rewarm()
+
+    def start(self, timeout):
+        """Start every worker process and wait until each has run its initializer; return their pids"""
+        executor = self._get_executor()
+        with multiprocessing.get_context('spawn').Manager() as manager:
+            barrier = manager.Barrier(self.workers)
+            try:
+                futures = [executor.submit(_started_job, barrier, timeout) for _ in range(self.workers)]
+                return {future.result(timeout=timeout) for future in futures}
+            except BrokenProcessPool:
+                self._discard(executor)
+                raise InferenceCrashed('An inference process died while starting.')
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args, timeout=None):
+        """Run fn(*args) in the pool and wait for the result"""
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise QueueFull('Face verification is busy, please try again shortly.')
+
+        start = time.perf_counter()
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._restart(executor)
+            raise InferenceCrashed('Face verification restarted, please try again.')
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending += 1
+        # The slot is held until the job really finishes, even after a timeout,
+        # so abandoned jobs still count against the queue bound.
+        future.add_done_callback(self._release)
+
+        try:
+            result = future.result(timeout=timeout or self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            self._count('timeouts')
+            raise InferenceTimeout('Face verification timed out, please try again.')
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise InferenceCrashed('Face verification restarted, please try again.')
+        self._count('completed')
+        self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def metrics(self):
+        with self._lock:
+            pending = self._pending
+        latencies = list(self._latencies)
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'in_flight': min(pending, self.workers),
+            'queue_depth': max(0, pending - self.workers),
+            'completed': self._counts['completed'],
+            'rejected': self._counts['rejected'],
+            'timeouts': self._counts['timeouts'],
+            'crashes': self._counts['crashes'],
+            'latency_ms': {
+                'p50': percentile_ms(latencies, 50),
+                'p95': percentile_ms(latencies, 95),
+                'p99': percentile_ms(latencies, 99),
+            },
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    from .embeddings import configured_models
+    from .threads import pool_workers
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = InferencePool(
+                workers=pool_workers(),
+                queue_size=settings.FACE_POOL_QUEUE_SIZE,
+                timeout=settings.FACE_POOL_TIMEOUT,
+                model_names=configured_models(),
+            )
+        return _pool
+
+
+def embed(image, model_name):
+    """Embed an image path or BGR array, in the inference pool when it is enabled"""
+    if settings.FACE_BATCH_ENABLED:
+        from .batching import get_batcher
+        return get_batcher(model_name).submit(image, timeout=settings.FACE_POOL_TIMEOUT)
+    if not settings.FACE_POOL_ENABLED:
+        from .embeddings import get_embedding
+        return get_embedding(image, model_name)
+    return get_pool().submit(_embed_job, image, model_name)
+
+
+def embed_batch(images, model_name):
+    """Embed a list of images as one batch, in the inference pool when it is enabled"""
+    if not settings.FACE_POOL_ENABLED:
+        from .embeddings import get_embeddings
+        return get_embeddings(images, model_name)
+    return get_pool().submit(_embed_batch_job, images, model_name)
+
+
+def metrics():
+    if not settings.FACE_POOL_ENABLED or _pool is None:
+        return None
+    return _pool.metrics()
@@ -0,0 +1,81 @@
+"""
+Detect-and-crop stage in front of the embedding backends.
+
+Lobby snapshots arrive at full camera resolution. With
+``FACE_PREPROCESS`` enabled, each frame (and each avatar) is downscaled so
+its longest side is at most ``FACE_WORKING_SIZE``, the largest face is
+found with OpenCV's Haar cascade and only that crop is embedded. The
+backends then skip their own detector. Per-stage timings are kept on the
+result so verify_face can report them.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+_cascade = None
+_cascade_lock = threading.Lock()
+
+
+class PreparedFace:
+    def __init__(self, image, box, timings):
+        self.image = image
+        # (x, y, w, h) in working-resolution coordinates, None if no face was found
+        self.box = box
+        self.timings = timings
+
+
+def _get_cascade():
+    global _cascade
+    with _cascade_lock:
+        if _cascade is None:
+            import cv2
+            _cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        return _cascade
+
+
+def detect_face(image):
+    """Return the (x, y, w, h) box of the largest face in a BGR image, or None"""
+    import cv2
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # Same parameters as DeepFace's opencv detector
+    faces = _get_cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=10)
+    if not len(faces):
+        return None
+    return tuple(int(v) for v in max(faces, key=lambda f: f[2] * f[3]))
+
+
+def downscale(image, max_side):
+    import cv2
+
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def prepare(image):
+    """Downscale, detect and crop an image path or BGR array"""
+    import cv2
+
+    timings = {}
+    if isinstance(image, str):
+        start = time.perf_counter()
+        image = cv2.imread(image, cv2.IMREAD_COLOR)
+        timings['load_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    start = time.perf_counter()
+    image = downscale(image, settings.FACE_WORKING_SIZE)
+    timings['resize_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    start = time.perf_counter()
+    box = detect_face(image)
+    timings['detect_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    # Without a detected face the whole (downscaled) frame is embedded, as enforce_detection=False did
+    if box is not None:
+        x, y, w, h = box
+        image = image[y:y + h, x:x + w]
+    return PreparedFace(image, box, timings)
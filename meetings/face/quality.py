@@ -0,0 +1,65 @@
+"""
+Frame quality pre-screen in front of the embedding pipeline.
+
+Dark, overexposed, blurred or faceless lobby captures can never match,
+yet each one used to cost a full embedding. ``assess(frame)`` rejects
+them in a few milliseconds with a reason code the lobby can explain:
+
+* exposure - mean and clipped share of a small grayscale histogram;
+* face size - the Haar detection from the preprocessing stage, which the
+  embedding stage then reuses;
+* blur - variance of the Laplacian over the face crop.
+"""
+from django.conf import settings
+
+MESSAGES = {
+    'unreadable': 'The image could not be read. Please try again.',
+    'too_dark': 'The image is too dark. Add some light in front of you and try again.',
+    'too_bright': 'The image is overexposed. Avoid strong light behind or in front of you and try again.',
+    'no_face': 'No face was found. Look straight at the camera and try again.',
+    'face_too_small': 'Your face is too small in the picture. Move closer to the camera and try again.',
+    'blurry': 'The image is blurry. Hold still and try again.',
+}
+
+
+def exposure(image):
+    """Return (mean brightness, share of blown-out pixels) of a BGR image"""
+    import cv2
+    import numpy as np
+
+    from .preprocessing import downscale
+
+    gray = cv2.cvtColor(downscale(image, 160), cv2.COLOR_BGR2GRAY)
+    histogram = np.bincount(gray.ravel(), minlength=256)
+    total = histogram.sum()
+    mean = float(histogram @ np.arange(256) / total)
+    return mean, float(histogram[250:].sum() / total)
+
+
+def sharpness(image):
+    import cv2
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def assess(frame):
+    """Return the reason the frame cannot be verified, or None if it looks usable"""
+    if frame.bgr is None:
+        return 'unreadable'
+
+    brightness, clipped = exposure(frame.bgr)
+    if brightness < settings.FACE_QUALITY_MIN_BRIGHTNESS:
+        return 'too_dark'
+    if brightness > settings.FACE_QUALITY_MAX_BRIGHTNESS or clipped > 0.3:
+        return 'too_bright'
+
+    face = frame.face
+    if face.box is None:
+        return 'no_face'
+    if min(face.box[2:]) < settings.FACE_QUALITY_MIN_FACE_SIZE:
+        return 'face_too_small'
+
+    if sharpness(face.image) < settings.FACE_QUALITY_MIN_SHARPNESS:
+        return 'blurry'
+    return None
@@ -0,0 +1,61 @@
+"""
+Exact-replay cache of verify_face results.
+
+Candidates press "Capture & Verify" repeatedly and flaky clients resubmit
+the same upload. Results are cached in the ``face_results`` cache alias,
+keyed by the user, a version of their avatar and matching configuration,
+and the SHA-256 of the frame bytes (of every frame, for a burst), so a
+byte-identical upload is answered without decoding it. TTL and eviction
+come from the cache backend.
+"""
+import collections
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+_lock = threading.Lock()
+_counts = collections.Counter()
+
+
+def _count(key):
+    with _lock:
+        _counts[key] += 1
+
+
+def avatar_version(user):
+    """Changes whenever the avatar or anything affecting its comparison does"""
+    from .embeddings import avatar_tag, gallery_version
+
+    version = (f'{avatar_tag(user)}:{gallery_version(user)}:'
+               f'{",".join(settings.FACE_MODELS)}:{settings.FACE_MATCH_THRESHOLD}')
+    return hashlib.sha256(version.encode()).hexdigest()[:16]
+
+
+def _key(user, digest):
+    return f'face_result:{user.pk}:{avatar_version(user)}:{digest}'
+
+
+def get(user, digest):
+    """Return the cached result for identical frame bytes (Frame.digest or burst_digest), or None"""
+    if not settings.FACE_RESULT_CACHE_ENABLED:
+        return None
+    result = caches['face_results'].get(_key(user, digest))
+    _count('hits' if result is not None else 'misses')
+    return result
+
+
+def remember(user, digest, result):
+    if settings.FACE_RESULT_CACHE_ENABLED:
+        caches['face_results'].set(_key(user, digest), result)
+
+
+def stats():
+    with _lock:
+        hits, misses = _counts['hits'], _counts['misses']
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+    }
@@ -0,0 +1,256 @@
+"""
+Quantized, memory-mapped on-disk store of avatar embeddings.
+
+Each model has two files in ``FACE_STORE_DIR``:
+
+* ``<model>.vec`` - a 16-byte header followed by append-only fixed-size
+  records of ``(float32 scale, dim x int8|float16)``, quantized with
+  ``FACE_STORE_DTYPE``.
+* ``<model>.idx.json`` - ``{"generation": n, "entries": {user_id: [record,
+  tag]}}`` where ``tag`` identifies the avatar and pipeline the record was
+  computed from.
+
+Worker processes map the vector file read-only and share its pages
+through the OS page cache; a lookup is a view into the mapping plus one
+small dequantized copy. Re-embedding a user appends a new record, and the
+file is compacted once more than ``FACE_STORE_COMPACT_RATIO`` of it is
+dead. Writers serialize on a lock file where ``fcntl`` is available.
+
+Compaction moves records, so it bumps the generation stored in both the
+header and the index. It writes the new index to ``<model>.idx.next``
+first, then replaces the vector file and finally the index. A reader only
+maps the two files when their generations agree and otherwise keeps its
+previous, self-consistent mapping until the index catches up; the next
+writer finishes a compaction that was interrupted between the renames.
+"""
+import contextlib
+import json
+import os
+import struct
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+MAGIC = b'FEMB'
+HEADER = struct.Struct('<4sBBxxII')  # magic, format version, dtype code, dim, generation -> 16 bytes
+FORMAT_VERSION = 1
+DTYPES = {1: 'int8', 2: 'float16'}
+DTYPE_CODES = {name: code for code, name in DTYPES.items()}
+
+
+def _record_dtype(dtype, dim):
+    import numpy as np
+    return np.dtype([('scale', '<f4'), ('vector', dtype, (dim,))])
+
+
+def quantize(vector, dtype):
+    import numpy as np
+
+    vector = np.asarray(vector, dtype=np.float32)
+    if dtype == 'int8':
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        return scale, np.round(vector / scale).astype(np.int8)
+    return 1.0, vector.astype(np.float16)
+
+
+@contextlib.contextmanager
+def _write_lock(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as handle:
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class EmbeddingStore:
+    def __init__(self, directory, model_name, dtype='int8'):
+        self.directory = Path(directory)
+        self.model_name = model_name
+        self.dtype = dtype
+        self.vec_path = self.directory / f'{model_name}.vec'
+        self.idx_path = self.directory / f'{model_name}.idx.json'
+        self.next_idx_path = self.directory / f'{model_name}.idx.next'
+        self.lock_path = self.directory / f'{model_name}.lock'
+        self._lock = threading.Lock()
+        self._records = None
+        self._index = {}
+        self._mapped_at = None
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._index)
+
+    def _read_header(self, handle=None):
+        """Return (dtype, dim, generation) of the vector file"""
+        if handle is None:
+            with open(self.vec_path, 'rb') as handle:
+                return self._read_header(handle)
+        magic, version, code, dim, generation = HEADER.unpack(handle.read(HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{self.vec_path} is not a face embedding store')
+        return DTYPES[code], dim, generation
+
+    def _refresh(self):
+        """(Re)map the files if another process has written since the last look"""
+        import numpy as np
+
+        try:
+            stamp = (self.idx_path.stat().st_mtime_ns, self.vec_path.stat().st_size)
+        except FileNotFoundError:
+            self._records, self._index, self._mapped_at = None, {}, None
+            return
+        if stamp == self._mapped_at:
+            return
+        try:
+            # The index first: put() appends a record before indexing it, so every entry of
+            # this index is within the records mapped below
+            index_generation, index = self._load_index()
+            # Header and records come from the same open file, even if it is replaced meanwhile
+            with open(self.vec_path, 'rb') as handle:
+                dtype, dim, generation = self._read_header(handle)
+                count = (os.fstat(handle.fileno()).st_size - HEADER.size) // _record_dtype(dtype, dim).itemsize
+                records = np.memmap(
+                    handle, dtype=_record_dtype(dtype, dim), mode='r', offset=HEADER.size, shape=(count,)
+                ) if count else None
+        except FileNotFoundError:
+            return
+        if index_generation != generation:
+            # Caught between the two renames of a compaction: the offsets in the index are for
+            # the other file, so keep the previous mapping and look again on the next call
+            return
+        self._records, self._index, self._mapped_at = records, index, stamp
+
+    def get(self, user_id, tag=None):
+        """Dequantized float32 embedding of a user, or None if missing or stale"""
+        with self._lock:
+            self._refresh()
+            entry = self._index.get(user_id)
+            if entry is None or self._records is None or (tag is not None and entry[1] != tag):
+                return None
+            record = self._records[entry[0]]
+            return record['vector'].astype('float32') * record['scale']
+
+    def vectors(self):
+        """Return (user_ids, float32 matrix) of every live embedding"""
+        import numpy as np
+
+        with self._lock:
+            self._refresh()
+            if self._records is None or not self._index:
+                return np.empty(0, dtype=np.int64), None
+            user_ids = np.fromiter(self._index, dtype=np.int64, count=len(self._index))
+            positions = np.fromiter((entry[0] for entry in self._index.values()), dtype=np.int64)
+            records = self._records[positions]
+            return user_ids, records['vector'].astype(np.float32) * records['scale'][:, None]
+
+    def _write_index(self, index, generation, path=None):
+        tmp_path = self.idx_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as handle:
+            json.dump({
+                'generation': generation,
+                'entries': {str(user_id): entry for user_id, entry in index.items()},
+            }, handle)
+        os.replace(tmp_path, path or self.idx_path)
+
+    def _load_index(self, path=None):
+        """Return (generation, {user_id: [record, tag]})"""
+        try:
+            with open(path or self.idx_path) as handle:
+                data = json.load(handle)
+        except FileNotFoundError:
+            return 0, {}
+        if 'entries' not in data:
+            data = {'generation': 0, 'entries': data}  # written before generations were recorded
+        return data['generation'], {int(user_id): entry for user_id, entry in data['entries'].items()}
+
+    def _recover(self):
+        """Finish or roll back a compaction that stopped between its renames (write lock held)"""
+        if not self.next_idx_path.exists():
+            return
+        try:
+            generation = self._read_header()[2]
+        except FileNotFoundError:
+            generation = None
+        if self._load_index(self.next_idx_path)[0] == generation:
+            os.replace(self.next_idx_path, self.idx_path)
+        else:
+            self.next_idx_path.unlink()  # the vector file was never replaced
+
+    def put(self, user_id, embedding, tag):
+        """Append a user's embedding, superseding any earlier record"""
+        import numpy as np
+
+        scale, quantized = quantize(embedding, self.dtype)
+        with self._lock, _write_lock(self.lock_path):
+            self._recover()
+            if not self.vec_path.exists():
+                with open(self.vec_path, 'wb') as handle:
+                    handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[self.dtype], len(quantized), 0))
+            dtype, dim, generation = self._read_header()
+            record = np.zeros(1, dtype=_record_dtype(dtype, dim))
+            if dtype != self.dtype:
+                scale, quantized = quantize(embedding, dtype)
+            record['scale'], record['vector'] = scale, quantized
+            with open(self.vec_path, 'ab') as handle:
+                position = (handle.tell() - HEADER.size) // record.itemsize
+                handle.write(record.tobytes())
+            _, index = self._load_index()
+            index[user_id] = [position, tag]
+            self._write_index(index, generation)
+            if position + 1 >= 1000 and len(index) < (position + 1) * (1 - settings.FACE_STORE_COMPACT_RATIO):
+                self._compact(index)
+
+    def remove(self, user_id):
+        with self._lock, _write_lock(self.lock_path):
+            self._recover()
+            generation, index = self._load_index()
+            if index.pop(user_id, None) is not None:
+                self._write_index(index, generation)
+
+    def compact(self):
+        with self._lock, _write_lock(self.lock_path):
+            self._recover()
+            self._compact(self._load_index()[1])
+
+    def _compact(self, index):
+        """Rewrite the vector file with only the live records"""
+        import numpy as np
+
+        if not self.vec_path.exists():
+            return
+        dtype, dim, generation = self._read_header()
+        generation = (generation + 1) % 2 ** 32
+        records = np.fromfile(self.vec_path, dtype=_record_dtype(dtype, dim), offset=HEADER.size)
+        user_ids = list(index)
+        tmp_path = self.vec_path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as handle:
+            handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[dtype], dim, generation))
+            handle.write(records[[index[user_id][0] for user_id in user_ids]].tobytes())
+        self._write_index(
+            {user_id: [position, index[user_id][1]] for position, user_id in enumerate(user_ids)},
+            generation, self.next_idx_path,
+        )
+        # Readers still holding the old mapping keep a valid view of the replaced file, and keep
+        # using it until the new index with the matching generation is in place
+        os.replace(tmp_path, self.vec_path)
+        os.replace(self.next_idx_path, self.idx_path)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(model_name):
+    with _stores_lock:
+        if model_name not in _stores:
+            _stores[model_name] = EmbeddingStore(settings.FACE_STORE_DIR, model_name, settings.FACE_STORE_DTYPE)
+        return _stores[model_name]
@@ -0,0 +1,89 @@
+"""
+CPU thread budget for face inference.
+
+Every web worker on a box loads its own TensorFlow, ONNX Runtime, OpenCV
+and BLAS, and each library defaults to one thread per core. With several
+workers (and inference pool processes) per box that oversubscribes the
+CPU many times over. ``budget()`` splits ``FACE_CPU_CORES`` between
+``FACE_WEB_WORKERS`` x inference processes, and ``apply()`` hands the
+share to every library through its thread environment variables before
+any of them is imported. ONNX Runtime sessions take it from
+``budget()`` directly. Variables already set in the environment win.
+"""
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_applied = None
+
+INTRA_OP_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'OPENCV_FOR_THREADS_NUM',
+    'TF_NUM_INTRAOP_THREADS',
+)
+INTER_OP_VARS = (
+    'TF_NUM_INTEROP_THREADS',
+)
+
+
+def available_cores():
+    if settings.FACE_CPU_CORES:
+        return settings.FACE_CPU_CORES
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def pool_workers():
+    """Inference processes per web worker when the pool is enabled"""
+    if settings.FACE_POOL_WORKERS:
+        return settings.FACE_POOL_WORKERS
+    return max(1, available_cores() // settings.FACE_WEB_WORKERS)
+
+
+def budget():
+    """How many threads each inference process may use"""
+    cores = available_cores()
+    processes = settings.FACE_WEB_WORKERS * (pool_workers() if settings.FACE_POOL_ENABLED else 1)
+    return {
+        'cores': cores,
+        'processes': processes,
+        'intra_op': settings.FACE_INTRA_OP_THREADS or max(1, cores // processes),
+        'inter_op': settings.FACE_INTER_OP_THREADS,
+    }
+
+
+def apply():
+    """Export the thread budget to the inference libraries of this process, once"""
+    global _applied
+    with _lock:
+        if _applied is None:
+            threads = budget()
+            for name in INTRA_OP_VARS:
+                os.environ.setdefault(name, str(threads['intra_op']))
+            for name in INTER_OP_VARS:
+                os.environ.setdefault(name, str(threads['inter_op']))
+            _applied = {
+                **threads,
+                'env': {name: os.environ[name] for name in INTRA_OP_VARS + INTER_OP_VARS},
+            }
+            logger.info(
+                "Face inference threads: %s cores over %s processes -> intra-op %s, inter-op %s (%s)",
+                threads['cores'], threads['processes'], threads['intra_op'], threads['inter_op'],
+                ', '.join(f'{name}={value}' for name, value in _applied['env'].items()),
+            )
+        return _applied
+
+
+def effective():
+    return _applied
@@ -0,0 +1,198 @@
+"""
+Face verification core used by verify_face.
+
+``verify(user, frame)`` compares a captured ``Frame`` with the user's
+avatar and returns the JSON payload for the lobby. Embeddings are used
+when a backend is installed, falling back to imagehash and finally to a
+plain pixel difference. ``verify_burst`` does the same for several
+frames of one capture and aggregates their scores.
+"""
+import logging
+import time
+
+from django.conf import settings
+
+from .pool import InferenceUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+def _result(matched, confidence, **extra):
+    return {
+        'success': True,
+        'matched': matched,
+        **extra,
+        'confidence': confidence,
+        'message': ' Face matched!' if matched else ' Face did not match.',
+    }
+
+
+def match_embeddings(user, frame, model_name=None):
+    from .embeddings import get_references
+    from .pool import embed
+
+    # Avatar and reference photo embeddings are precomputed on upload, so only the captured frame is embedded here
+    model_name, fallback_model = model_name or settings.FACE_MODELS[0], settings.FACE_MODELS[-1]
+    image = frame.embedding_input
+    start = time.perf_counter()
+    try:
+        references = get_references(user, model_name)
+        emb_captured = embed(image, model_name)
+    except (ImportError, InferenceUnavailable):
+        raise
+    except Exception as e:
+        logger.warning("%s failed: %s", model_name, e)
+        model_name = fallback_model
+        references = get_references(user, model_name)
+        emb_captured = embed(image, model_name)
+    embed_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    if settings.FACE_DUPLICATE_CHECK:
+        check_duplicates(user, emb_captured, model_name)
+
+    similarity = float(best_scores(references, [emb_captured])[0])
+    matched = similarity > settings.FACE_MATCH_THRESHOLD
+    extra = {'similarity': round(similarity, 3), 'references': len(references)}
+    if settings.FACE_PREPROCESS:
+        extra['timings'] = {**frame.face.timings, 'embed_ms': embed_ms}
+    return _result(matched, round(similarity * 100, 2), **extra)
+
+
+def best_scores(references, embeddings):
+    """Best cosine similarity of each embedding over the rows of references"""
+    import numpy as np
+
+    references = np.atleast_2d(np.asarray(references, dtype=np.float32))
+    matrix = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    references = references / np.linalg.norm(references, axis=1, keepdims=True)
+    matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix @ references.T).max(axis=1)
+
+
+def aggregate_scores(scores, method):
+    """Reduce per-frame scores to one: their median, or the k-th best for 'best_k'"""
+    import numpy as np
+
+    if method == 'best_k':
+        k = min(settings.FACE_BURST_BEST_K, len(scores))
+        return float(np.sort(scores)[-k])
+    return float(np.median(scores))
+
+
+def match_burst(user, frames, method, model_name=None):
+    from .embeddings import get_references
+    from .pool import embed_batch
+
+    # All frames go through the model as one batch and are scored in one product
+    model_name, fallback_model = model_name or settings.FACE_MODELS[0], settings.FACE_MODELS[-1]
+    images = [frame.embedding_input for frame in frames]
+    try:
+        references = get_references(user, model_name)
+        embeddings = embed_batch(images, model_name)
+    except (ImportError, InferenceUnavailable):
+        raise
+    except Exception as e:
+        logger.warning("%s failed: %s", model_name, e)
+        model_name = fallback_model
+        references = get_references(user, model_name)
+        embeddings = embed_batch(images, model_name)
+
+    scores = best_scores(references, embeddings)
+    similarity = aggregate_scores(scores, method)
+    return _result(
+        similarity > settings.FACE_MATCH_THRESHOLD, round(similarity * 100, 2),
+        similarity=round(similarity, 3), frames=len(frames), aggregate=method, references=len(references),
+        scores=[round(float(score), 3) for score in scores],
+    )
+
+
+def compare_frame(references, frame, model_name):
+    """Embed the frame and compare it with already loaded avatar / reference embeddings"""
+    from .pool import embed
+
+    similarity = float(best_scores(references, [embed(frame.embedding_input, model_name)])[0])
+    return similarity > settings.FACE_MATCH_THRESHOLD, similarity
+
+
+def check_duplicates(user, embedding, model_name):
+    """Log other accounts whose avatar matches this face (e.g. a proxy using two accounts)"""
+    from .index import find_duplicates
+
+    try:
+        duplicates = find_duplicates(user, embedding, model_name)
+    except Exception as e:
+        logger.warning("Duplicate identity check failed for user %s: %s", user.pk, e)
+        return []
+    if duplicates:
+        logger.warning(
+            "Face captured for user %s also matches users %s",
+            user.pk, ', '.join(f'{user_id} ({score:.3f})' for user_id, score in duplicates)
+        )
+    return duplicates
+
+
+def hash_image(image):
+    """Normalise a PIL image before average hashing"""
+    return image.resize((256, 256)).convert('L')
+
+
+def gray_pixels(image):
+    """Flattened 200x200 grayscale uint8 pixels of a PIL image"""
+    import numpy as np
+    return np.array(image.convert('RGB').resize((200, 200)).convert('L')).flatten()
+
+
+def match_imagehash(user, frame):
+    import imagehash
+    from .embeddings import get_avatar_fallback
+
+    # The avatar side is hashed once at upload and stored with its embeddings
+    avatar_hash = imagehash.hex_to_hash(get_avatar_fallback(user, 'average_hash'))
+    hamming_distance = avatar_hash - imagehash.average_hash(hash_image(frame.pil))
+    matched = bool(hamming_distance <= 10)
+    similarity = max(0, (1 - hamming_distance / 64) * 100)
+    return _result(matched, round(similarity, 1))
+
+
+def match_pixels(user, frame):
+    import numpy as np
+    from .embeddings import get_avatar_fallback
+
+    pixels1 = get_avatar_fallback(user, 'pixels').astype(np.float32)
+    pixels2 = gray_pixels(frame.pil).astype(np.float32)
+
+    mse = float(np.mean((pixels1 - pixels2) ** 2))
+    similarity = max(0, (1 - mse / (255 ** 2)) * 100)
+    return _result(bool(similarity >= 70), round(similarity, 1))
+
+
+def verify(user, frame, model_name=None):
+    """Match the frame against the user's avatar with the best available method.
+
+    model_name overrides the first of FACE_MODELS, e.g. with a cheaper model under load.
+    """
+    try:
+        return match_embeddings(user, frame, model_name)
+    except ImportError:
+        pass
+    # DeepFace not installed - fall back to imagehash, then to a basic pixel diff
+    try:
+        return match_imagehash(user, frame)
+    except ImportError:
+        return match_pixels(user, frame)
+
+
+def verify_burst(user, frames, method, model_name=None):
+    """Match a burst of frames against the user's avatar and aggregate the decision"""
+    try:
+        return match_burst(user, frames, method, model_name)
+    except ImportError:
+        pass
+    # Without embeddings each frame goes through the fallbacks; the frame whose
+    # confidence is the aggregate stands for the whole burst
+    results = sorted((verify(user, frame) for frame in frames), key=lambda result: result['confidence'])
+    if method == 'best_k':
+        chosen = results[-min(settings.FACE_BURST_BEST_K, len(results))]
+    else:
+        chosen = results[len(results) // 2]
+    return {**chosen, 'frames': len(frames), 'aggregate': method}
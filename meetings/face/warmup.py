@@ -0,0 +1,148 @@
+"""
+Per-process warm-up of the face recognition models.
+
+DeepFace loads model weights lazily, so without a warm-up the first
+candidate hitting each worker waits for TensorFlow to build the models.
+``MeetingsConfig.ready`` starts the warm-up in a background thread when
+``FACE_WARMUP`` is enabled; process managers with their own boot hooks
+(e.g. gunicorn ``post_fork``) can call ``warm_up()`` directly instead.
+``is_ready()`` backs the ``meetings:face_ready`` probe; a worker only
+becomes ready once every configured model has warmed up (failures are
+retried a few times), or when DeepFace is not installed at all. With the
+inference pool, every pool process is started and has loaded the models
+first, and a pool restarted after a crash is warmed again before the
+worker reports ready.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_ATTEMPTS = 3
+WARM_UP_RETRY_DELAY = 5  # seconds
+WARM_UP_POOL_TIMEOUT = 300  # seconds for every pool process to start and load the models
+
+_lock = threading.Lock()
+_state = {
+    'started': False,
+    'ready': False,
+    'load_times': {},
+    'errors': {},
+}
+
+
+def warm_up():
+    """Load every configured model and run one dummy inference through it"""
+    with _lock:
+        if _state['ready']:
+            return _state
+        _state['started'] = True
+
+        if settings.FACE_POOL_ENABLED:
+            # Inference happens in the pool processes; warm those instead of this one
+            import numpy as np
+            from .pool import embed
+
+            if not _start_pool():
+                return _state
+            dummy = np.zeros((224, 224, 3), dtype=np.uint8)
+            _state['ready'] = _warm_models(lambda model_name: embed(dummy, model_name), ' in the inference pool')
+        else:
+            from .backends import get_backend
+
+            _state['ready'] = _warm_models(get_backend().warm_up, '')
+        return _state
+
+
+def _start_pool():
+    """Start every inference process, retrying failures; True once all have loaded the models"""
+    from .pool import get_pool
+
+    for attempt in range(WARM_UP_ATTEMPTS):
+        if attempt:
+            time.sleep(WARM_UP_RETRY_DELAY)
+        start = time.perf_counter()
+        try:
+            processes = get_pool().start(WARM_UP_POOL_TIMEOUT)
+        except Exception as e:
+            _state['errors']['pool'] = str(e) or type(e).__name__
+            logger.warning("Inference pool failed to start: %r", e)
+            continue
+        _state['errors'].pop('pool', None)
+        _state['load_times']['pool'] = round(time.perf_counter() - start, 3)
+        logger.info("Started %s inference processes in %.2fs", len(processes), _state['load_times']['pool'])
+        return True
+    return False
+
+
+def _warm_models(warm, where):
+    """Warm every configured model, retrying failures; True once all are warm or none can be"""
+    from .embeddings import configured_models
+
+    pending = configured_models()
+    for attempt in range(WARM_UP_ATTEMPTS):
+        if attempt:
+            time.sleep(WARM_UP_RETRY_DELAY)
+        failed = []
+        for model_name in pending:
+            start = time.perf_counter()
+            try:
+                warm(model_name)
+            except ImportError as e:
+                # Only the imagehash / pixel fallbacks are available, nothing to load
+                logger.info("Face warm-up skipped: %s", e)
+                return True
+            except Exception as e:
+                _state['errors'][model_name] = str(e)
+                logger.warning("Face model %s failed to warm up%s: %s", model_name, where, e)
+                failed.append(model_name)
+                continue
+            elapsed = time.perf_counter() - start
+            _state['errors'].pop(model_name, None)
+            _state['load_times'][model_name] = round(elapsed, 3)
+            logger.info("Face model %s warmed%s in %.2fs", model_name, where, elapsed)
+        if not failed:
+            return True
+        pending = failed
+    # Not ready: the probe keeps this worker out of rotation and reports the errors
+    return False
+
+
+def rewarm():
+    """Warm the inference pool again after it was restarted; not ready until then"""
+    if not settings.FACE_WARMUP:
+        return
+    _state['ready'] = False
+    threading.Thread(target=warm_up, name='face-warmup', daemon=True).start()
+
+
+def start_warm_up():
+    """Run warm_up() in a daemon thread so startup is not blocked"""
+    if _state['started']:
+        return
+    _state['started'] = True
+    threading.Thread(target=warm_up, name='face-warmup', daemon=True).start()
+
+
+def is_ready():
+    # Without a configured warm-up, models load lazily and the worker is always routable
+    return _state['ready'] or not settings.FACE_WARMUP
+
+
+def status():
+    from . import gate, load, results, threads
+    from .pool import metrics
+
+    return {
+        'ready': is_ready(),
+        'load_times': dict(_state['load_times']),
+        'errors': dict(_state['errors']),
+        'pool': metrics(),
+        'gate': gate.stats(),
+        'result_cache': results.stats(),
+        'load': load.stats(),
+        'threads': threads.effective(),
+    }
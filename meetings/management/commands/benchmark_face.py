@@ -0,0 +1,176 @@
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from argparse import SUPPRESS as SUPPRESS_HELP
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from meetings.face.pool import percentile_ms
+
+PATHS = ['Facenet512', 'VGG-Face', 'imagehash', 'pixels']
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor, 1)
+
+
+def _synthetic_frames():
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    gradient = np.tile(np.linspace(0, 255, 1280, dtype=np.uint8), (720, 1))
+    gradient = cv2.cvtColor(gradient, cv2.COLOR_GRAY2BGR)
+    return [cv2.imencode('.jpg', image)[1].tobytes() for image in (noise, gradient)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the face verification pipeline for each matching path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', nargs='+', default=PATHS, choices=PATHS)
+        parser.add_argument('--avatar', help='Avatar file relative to MEDIA_ROOT (default: first in avatars/)')
+        parser.add_argument('--frames', default=str(Path(settings.MEDIA_ROOT) / 'avatars' / '*'),
+                            help='Glob of fixture frames; synthetic frames are always added')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per concurrency level')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+        parser.add_argument('--pool', action='store_true', help='Embed in the inference pool (FACE_POOL_ENABLED)')
+        parser.add_argument('--batching', action='store_true', help='Micro-batch embeddings (FACE_BATCH_ENABLED)')
+        parser.add_argument('--output', default='face_benchmark.json')
+        parser.add_argument('--child', help=SUPPRESS_HELP)
+
+    def handle(self, *args, **options):
+        if options['child']:
+            result = self.run_path(options['child'], options)
+            self.stdout.write(json.dumps(result))
+            return
+
+        results = {}
+        for path in options['paths']:
+            self.stdout.write(f'Benchmarking {path}...')
+            # One process per path so cold start and peak RSS are measured in isolation
+            command = [
+                sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'benchmark_face',
+                '--child', path,
+                '--frames', options['frames'],
+                '--requests', str(options['requests']),
+                '--concurrency', *[str(level) for level in options['concurrency']],
+            ]
+            if options['avatar']:
+                command += ['--avatar', options['avatar']]
+            # No background warm-up, so the child starts cold; pool and batching only when measured
+            env = {
+                **os.environ,
+                'FACE_WARMUP': 'False',
+                'FACE_POOL_ENABLED': str(options['pool']),
+                'FACE_BATCH_ENABLED': str(options['batching']),
+            }
+            completed = subprocess.run(command, capture_output=True, text=True, env=env)
+            if completed.returncode != 0:
+                lines = completed.stderr.strip().splitlines()
+                results[path] = {'error': lines[-1] if lines else f'exit code {completed.returncode}'}
+            else:
+                results[path] = json.loads(completed.stdout.strip().splitlines()[-1])
+            self.stdout.write(json.dumps(results[path]))
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'backend': settings.FACE_EMBEDDING_BACKEND,
+                'preprocess': settings.FACE_PREPROCESS,
+                'pool': options['pool'],
+                'batching': options['batching'],
+                'requests': options['requests'],
+            },
+            'paths': results,
+        }
+        Path(options['output']).write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+
+    def run_path(self, path, options):
+        from meetings.face.embeddings import avatar_input, get_embedding
+        from meetings.face.frames import Frame
+        from meetings.face.verification import compare_frame, match_imagehash, match_pixels
+
+        avatar = options['avatar']
+        if not avatar:
+            avatars = sorted((Path(settings.MEDIA_ROOT) / 'avatars').glob('*'))
+            if not avatars:
+                raise CommandError('No avatar fixture found; pass --avatar')
+            avatar = str(avatars[0].relative_to(settings.MEDIA_ROOT))
+        # Unsaved user: the benchmark never writes embeddings back to the database
+        user = get_user_model()(avatar=avatar)
+
+        frames = [Path(name).read_bytes() for name in sorted(glob.glob(options['frames']))]
+        try:
+            frames += _synthetic_frames()
+        except ImportError:
+            pass
+        if not frames:
+            raise CommandError('No frames to benchmark')
+
+        if path in ('imagehash', 'pixels'):
+            matcher = match_imagehash if path == 'imagehash' else match_pixels
+
+            def verify(data):
+                return matcher(user, Frame(data))
+        else:
+            avatar_embedding = None
+
+            def verify(data):
+                nonlocal avatar_embedding
+                if avatar_embedding is None:
+                    # Stored at upload time in production; computed once here
+                    avatar_embedding = get_embedding(avatar_input(user), path)
+                return compare_frame(avatar_embedding, Frame(data), path)
+
+        start = time.perf_counter()
+        verify(frames[0])
+        cold_start_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        levels = {}
+        for clients in options['concurrency']:
+            latencies = []
+
+            def timed(data):
+                started = time.perf_counter()
+                verify(data)
+                latencies.append(time.perf_counter() - started)
+
+            workload = [frames[i % len(frames)] for i in range(options['requests'])]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                list(executor.map(timed, workload))
+            elapsed = time.perf_counter() - started
+            levels[str(clients)] = {
+                'p50_ms': percentile_ms(latencies, 50),
+                'p95_ms': percentile_ms(latencies, 95),
+                'p99_ms': percentile_ms(latencies, 99),
+                'throughput_rps': round(len(workload) / elapsed, 2),
+            }
+
+        return {
+            'cold_start_ms': cold_start_ms,
+            'peak_rss_mb': _peak_rss_mb(),
+            'frames': len(frames),
+            'concurrency': levels,
+        }
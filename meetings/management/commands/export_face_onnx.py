@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Export DeepFace model weights to ONNX for the onnx embedding backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='Models to export (default: all in FACE_ONNX_MODELS)')
+        parser.add_argument('--opset', type=int, default=13)
+
+    def handle(self, *args, **options):
+        try:
+            import tensorflow as tf
+            import tf2onnx
+            from deepface import DeepFace
+        except ImportError as e:
+            raise CommandError(f'Exporting needs deepface and tf2onnx installed: {e}')
+
+        from meetings.face.backends import OnnxBackend
+
+        for model_name in options['models'] or list(settings.FACE_ONNX_MODELS):
+            if model_name not in settings.FACE_ONNX_MODELS:
+                raise CommandError(f'No output path configured for {model_name} in FACE_ONNX_MODELS')
+            output = Path(settings.FACE_ONNX_MODELS[model_name])
+            output.parent.mkdir(parents=True, exist_ok=True)
+
+            keras_model = DeepFace.build_model(model_name).model
+            height, width = OnnxBackend.INPUT_SIZES.get(model_name, (160, 160))
+            signature = (tf.TensorSpec((None, height, width, 3), tf.float32, name='input'),)
+            tf2onnx.convert.from_keras(
+                keras_model,
+                input_signature=signature,
+                opset=options['opset'],
+                output_path=str(output),
+            )
+            self.stdout.write(self.style.SUCCESS(f'Exported {model_name} to {output}'))
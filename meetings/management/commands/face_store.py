@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from meetings.face.embeddings import sync_store
+from meetings.face.store import get_store
+
+
+class Command(BaseCommand):
+    help = 'Backfill or compact the quantized on-disk avatar embedding store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help='Copy the embeddings stored on every user into the store')
+        parser.add_argument('--compact', action='store_true',
+                            help='Rewrite the store without superseded records')
+
+    def handle(self, *args, **options):
+        if not (options['backfill'] or options['compact']):
+            raise CommandError('Pass --backfill and/or --compact')
+
+        if options['backfill']:
+            users = get_user_model().objects.exclude(face_encoding__isnull=True).exclude(face_encoding='')
+            count = 0
+            for user in users.only('id', 'avatar', 'face_encoding').iterator(chunk_size=2000):
+                sync_store(user)
+                count += 1
+            self.stdout.write(f'Wrote embeddings of {count} users to {settings.FACE_STORE_DIR}')
+
+        if options['compact']:
+            for model_name in settings.FACE_MODELS:
+                get_store(model_name).compact()
+            self.stdout.write(self.style.SUCCESS(f'Compacted {settings.FACE_STORE_DIR}'))
+
+        for model_name in settings.FACE_MODELS:
+            self.stdout.write(f'{model_name}: {len(get_store(model_name))} users ({settings.FACE_STORE_DTYPE})')
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from meetings.face.embeddings import stored_embedding
+from meetings.face.index import FaceIndex
+
+
+class Command(BaseCommand):
+    help = 'Find registered accounts whose avatars show the same face'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=settings.FACE_MODELS[0])
+        parser.add_argument('--user', help='Only search for matches of this user (email or id)')
+        parser.add_argument('--threshold', type=float, default=settings.FACE_MATCH_THRESHOLD)
+        parser.add_argument('--top-k', type=int, default=settings.FACE_INDEX_TOP_K)
+        parser.add_argument('--save', action='store_true',
+                            help=f'Write the index to FACE_INDEX_DIR ({settings.FACE_INDEX_DIR}) for workers to mmap')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        model_name = options['model']
+        index = FaceIndex.build(model_name)
+        self.stdout.write(f'Indexed {len(index)} avatar embeddings for {model_name}')
+
+        if options['save']:
+            index.save(settings.FACE_INDEX_DIR)
+            self.stdout.write(self.style.SUCCESS(f'Saved index to {settings.FACE_INDEX_DIR}'))
+
+        if options['user']:
+            lookup = {'pk': options['user']} if options['user'].isdigit() else {'email': options['user']}
+            try:
+                user = User.objects.get(**lookup)
+            except User.DoesNotExist:
+                raise CommandError(f'User {options["user"]} not found')
+            embedding = stored_embedding(user, model_name)
+            if embedding is None:
+                raise CommandError(f'{user} has no stored {model_name} embedding')
+            pairs = [
+                (user.pk, other_id, score)
+                for other_id, score in index.search(embedding, k=options['top_k'], exclude=user.pk)
+                if score > options['threshold']
+            ]
+        else:
+            pairs = sorted(index.duplicate_pairs(options['threshold']), key=lambda pair: -pair[2])
+
+        emails = dict(User.objects.filter(
+            pk__in={user_id for pair in pairs for user_id in pair[:2]}
+        ).values_list('pk', 'email'))
+        for user_id, other_id, score in pairs:
+            self.stdout.write(f'{emails.get(user_id)} <-> {emails.get(other_id)}: {score:.3f}')
+        if not pairs:
+            self.stdout.write('No duplicate faces found')
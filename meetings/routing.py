@@ -0,0 +1,7 @@
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'ws/identity/(?P<meeting_id>[0-9a-f-]+)/$', consumers.IdentityConsumer.as_asgi()),
+    re_path(r'ws/verify-face/$', consumers.VerificationConsumer.as_asgi()),
+]
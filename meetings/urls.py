@@ -14,6 +14,8 @@ urlpatterns = [
     path('<uuid:pk>/lobby/', views.lobby, name='lobby'),
     path('<uuid:pk>/verify/', views.verify_and_enter, name='verify_and_enter'),
     path('verify-face/', views.verify_face, name='verify_face'),
+    path('verify-face/burst/', views.verify_face_burst, name='verify_face_burst'),
+    path('face/ready/', views.face_ready, name='face_ready'),
     path('<uuid:pk>/room/', views.meeting_room, name='meeting_room'),
     path('<uuid:pk>/start/', views.start_meeting, name='start_meeting'),
     path('<uuid:pk>/end/', views.end_meeting, name='end_meeting'),
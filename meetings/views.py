@@ -8,6 +8,7 @@ from django.urls import reverse_lazy, reverse
 from django.http import JsonResponse
 from django.db.models import Q
 from django.db import models
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from .models import Meeting, MeetingParticipant, MeetingMessage
@@ -218,6 +219,7 @@ def meeting_room(request, pk):
         'meeting': meeting,
         'participant': participant,
         'is_host': meeting.host == request.user,
+        'identity_check_interval': settings.FACE_RECHECK_INTERVAL,
     }
     return render(request, 'meetings/meeting_room.html', context)
 
@@ -265,21 +267,13 @@ def leave_meeting(request, pk):
 
 @login_required
 def get_meeting_participants(request, pk):
-    meeting = get_object_or_404(Meeting, pk=pk)
-    participants = meeting.meeting_participants.all()
+    """Roster snapshot; seq is the last roster delta it includes"""
+    from chat.roster import snapshot
     
-    data = []
-    for participant in participants:
-        data.append({
-            'id': participant.user.id,
-            'username': participant.user.username,
-            'full_name': participant.user.full_name,
-            'is_audio_enabled': participant.is_audio_enabled,
-            'is_video_enabled': participant.is_video_enabled,
-            'is_screen_sharing': participant.is_screen_sharing,
-        })
+    meeting = get_object_or_404(Meeting, pk=pk)
+    seq, participants = snapshot(meeting.pk)
     
-    return JsonResponse({'participants': data})
+    return JsonResponse({'seq': seq, 'participants': participants})
 
 
 @login_required
@@ -296,12 +290,14 @@ def get_meeting_messages(request, pk):
         models.Q(recipient__isnull=True) |  # Public messages
         models.Q(recipient=request.user) |  # Private messages to me
         models.Q(sender=request.user)       # Private messages from me
-    ).select_related('sender', 'recipient').order_by('timestamp')[:100]
+    ).select_related('sender', 'recipient').defer(
+        'sender__face_encoding', 'recipient__face_encoding'  # embeddings, not needed here
+    ).order_by('timestamp')[:100]
     
     data = []
     for message in messages:
         data.append({
-            'id': message.id,
+            'id': str(message.uid),
             'sender': message.sender.username,
             'sender_id': message.sender.id,
             'sender_full_name': message.sender.full_name,
@@ -335,6 +331,7 @@ def lobby(request, pk):
         'meeting': meeting,
         'is_host': meeting.host == request.user,
         'user': request.user,
+        'face_burst_frames': settings.FACE_BURST_FRAMES,
     }
     return render(request, 'meetings/lobby.html', context)
 
@@ -382,6 +379,21 @@ def verify_and_enter(request, pk):
     return JsonResponse({'success': True, 'redirect_url': reverse('meetings:meeting_room', args=[pk])})
 
 
+def face_ready(request):
+    """Readiness probe: 503 until this worker has warmed its face models"""
+    from .face.warmup import status
+    
+    data = status()
+    return JsonResponse(data, status=200 if data['ready'] else 503)
+
+
+def _rejection_response(rejected):
+    response = JsonResponse(rejected.payload, status=rejected.status)
+    if rejected.retry_after:
+        response['Retry-After'] = str(rejected.retry_after)
+    return response
+
+
 @login_required
 @csrf_exempt
 @require_POST
@@ -389,117 +401,51 @@ def verify_and_enter(request, pk):
 @csrf_exempt
 @require_POST
 def verify_face(request):
-    """Verify face match with profile photo (no dlib / compiler required)"""
+    """Verify face match with profile photo (no dlib / compiler required)
+
+    Accepts the frame as raw JPEG bytes (application/octet-stream), as a
+    multipart ``face_image`` file, or as a JSON ``face_image`` data URL.
+    """
+    from .face.frames import Frame
+    from .face.pipeline import Rejected, verify_frame
+
     try:
-        data = json.loads(request.body)
-        face_image_data = data.get('face_image')
+        frame = Frame.from_request(request)
 
-        if not face_image_data:
+        if frame is None:
             return JsonResponse({'success': False, 'error': 'No face image provided'}, status=400)
 
-        user = request.user
-        if not user.avatar:
-            return JsonResponse({
-                'success': False,
-                'matched': False,
-                'error': 'Please upload a profile photo first. Go to your profile to add one.'
-            }, status=400)
-
-        # Decode base64 → OpenCV image
-        import cv2, base64, numpy as np
-        img_bytes = base64.b64decode(face_image_data.split(',')[1])
-        np_bytes = np.frombuffer(img_bytes, np.uint8)
-        captured_img = cv2.imdecode(np_bytes, cv2.IMREAD_COLOR)
-
-        # --- Try DeepFace (no dlib required) ---
-        try:
-            from deepface import DeepFace
-
-            def get_embedding(image, model="Facenet512"):
-                return DeepFace.represent(
-                    img_path=image,
-                    model_name=model,
-                    enforce_detection=False
-                )[0]["embedding"]
-
-            # Try Facenet512 first
-            try:
-                emb_avatar = get_embedding(user.avatar.path, model="Facenet512")
-                emb_captured = get_embedding(captured_img, model="Facenet512")
-            except Exception as e1:
-                print(f"[WARN] Facenet512 failed: {e1}")
-                # fallback to VGG-Face
-                emb_avatar = get_embedding(user.avatar.path, model="VGG-Face")
-                emb_captured = get_embedding(captured_img, model="VGG-Face")
-
-            # Cosine similarity
-            similarity = float(np.dot(emb_avatar, emb_captured) /
-                               (np.linalg.norm(emb_avatar) * np.linalg.norm(emb_captured)))
-            matched = similarity > 0.35  # tuned threshold
-
-            return JsonResponse({
-                'success': True,
-                'matched': matched,
-                'similarity': round(similarity, 3),
-                'confidence': round(similarity * 100, 2),
-                'message': ' Face matched!' if matched else ' Face did not match.'
-            })
-
-        except ImportError:
-            # --- DeepFace not installed — fallback to imagehash ---
-            try:
-                from PIL import Image
-                import io, imagehash
-
-                avatar_image = Image.open(user.avatar.path)
-                image_data = base64.b64decode(face_image_data.split(',')[1])
-                captured_image = Image.open(io.BytesIO(image_data))
-
-                # Resize and grayscale
-                size = (256, 256)
-                avatar_gray = avatar_image.resize(size).convert('L')
-                captured_gray = captured_image.resize(size).convert('L')
-
-                avatar_hash = imagehash.average_hash(avatar_gray)
-                captured_hash = imagehash.average_hash(captured_gray)
-                hamming_distance = avatar_hash - captured_hash
-
-                MATCH_THRESHOLD = 10
-                matched = hamming_distance <= MATCH_THRESHOLD
-                similarity = max(0, (1 - hamming_distance / 64) * 100)
-
-                return JsonResponse({
-                    'success': True,
-                    'matched': matched,
-                    'confidence': round(similarity, 1),
-                    'message': ' Face matched!' if matched else ' Face did not match.'
-                })
-
-            except ImportError:
-                # --- imagehash not installed — fallback to basic pixel diff ---
-                from PIL import Image, ImageStat
-                import io
-
-                avatar = Image.open(user.avatar.path).convert('RGB').resize((200, 200))
-                image_data = base64.b64decode(face_image_data.split(',')[1])
-                captured = Image.open(io.BytesIO(image_data)).convert('RGB').resize((200, 200))
-
-                avatar_gray = avatar.convert('L')
-                captured_gray = captured.convert('L')
-
-                pixels1 = np.array(avatar_gray).flatten()
-                pixels2 = np.array(captured_gray).flatten()
-
-                mse = np.mean((pixels1 - pixels2) ** 2)
-                similarity = max(0, (1 - mse / (255 ** 2)) * 100)
-                matched = similarity >= 70
-
-                return JsonResponse({
-                    'success': True,
-                    'matched': matched,
-                    'confidence': round(similarity, 1),
-                    'message': ' Face matched!' if matched else ' Face did not match.'
-                })
+        return JsonResponse(verify_frame(request.user, frame, request.session.session_key))
+
+    except Rejected as e:
+        return _rejection_response(e)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@login_required
+@csrf_exempt
+@require_POST
+def verify_face_burst(request):
+    """Verify several frames of one capture in a single request
+
+    Accepts multipart ``face_images`` files or a JSON ``face_images`` list of
+    data URLs. ``?aggregate=median|best_k`` picks how the per-frame scores
+    are combined.
+    """
+    from .face.frames import Frame
+    from .face.pipeline import Rejected, verify_frames
+
+    try:
+        frames = Frame.list_from_request(request)
+
+        if not frames:
+            return JsonResponse({'success': False, 'error': 'No face images provided'}, status=400)
+
+        method = request.GET.get('aggregate', settings.FACE_BURST_AGGREGATE)
+        return JsonResponse(verify_frames(request.user, frames, method, request.session.session_key))
 
+    except Rejected as e:
+        return _rejection_response(e)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
@@ -7,6 +7,7 @@ from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import chat.routing
+import meetings.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'onlinemeet.settings')
 
@@ -14,7 +15,8 @@ application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AuthMiddlewareStack(
         URLRouter(
-            chat.routing.websocket_urlpatterns
+            chat.routing.websocket_urlpatterns +
+            meetings.routing.websocket_urlpatterns
         )
     ),
 })
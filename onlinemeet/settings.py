@@ -149,6 +149,34 @@ CHANNEL_LAYERS = {
         },
     },
 }
+# Roster changes within this window go out to the meeting as one delta
+CHAT_ROSTER_COALESCE_MS = config('CHAT_ROSTER_COALESCE_MS', default=200, cast=int)
+# Seconds a participant stays on the roster unless one of their open sockets refreshes it
+CHAT_ROSTER_PRESENCE_TTL = config('CHAT_ROSTER_PRESENCE_TTL', default=60, cast=int)
+# Chat messages are broadcast first and written in batches (see chat.outbox)
+CHAT_WRITE_BEHIND_MS = config('CHAT_WRITE_BEHIND_MS', default=50, cast=int)
+CHAT_WRITE_BATCH_SIZE = config('CHAT_WRITE_BATCH_SIZE', default=100, cast=int)
+CHAT_WRITE_MAX_PENDING = config('CHAT_WRITE_MAX_PENDING', default=5000, cast=int)
+
+# Cache
+CACHES = {
+    # Also holds the chat roster sequence numbers, so it must be shared
+    # (Redis, Memcached) when running more than one worker
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # verify_face results for exact frame replays; LocMem evicts the least
+    # recently used entries beyond MAX_ENTRIES. Point it at FileBasedCache to
+    # share results between the workers of a node.
+    'face_results': {
+        'BACKEND': config('FACE_RESULT_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('FACE_RESULT_CACHE_LOCATION', default='face-results'),
+        'TIMEOUT': config('FACE_RESULT_CACHE_TTL', default=600, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('FACE_RESULT_CACHE_SIZE', default=1000, cast=int),
+        },
+    },
+}
 
 # REST Framework
 REST_FRAMEWORK = {
@@ -183,5 +211,100 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'meetings': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
+
+# Face verification
+# Models tried in order by verify_face; avatar embeddings are stored per model.
+FACE_MODELS = ['Facenet512', 'VGG-Face']
+FACE_MATCH_THRESHOLD = config('FACE_MATCH_THRESHOLD', default=0.35, cast=float)
+# Reference photos a user can enroll next to the avatar; a frame matches the best of them
+FACE_GALLERY_MAX_PHOTOS = config('FACE_GALLERY_MAX_PHOTOS', default=5, cast=int)
+# 'deepface' (tf-keras) or 'onnx' (ONNX Runtime for the models in FACE_ONNX_MODELS)
+FACE_EMBEDDING_BACKEND = config('FACE_EMBEDDING_BACKEND', default='deepface')
+FACE_ONNX_MODELS = {
+    'Facenet512': config('FACE_ONNX_FACENET512', default=str(BASE_DIR / 'models' / 'facenet512.onnx')),
+}
+# 0 takes the intra-op share from the CPU thread budget below
+FACE_ONNX_INTRA_OP_THREADS = config('FACE_ONNX_INTRA_OP_THREADS', default=0, cast=int)
+FACE_ONNX_INTER_OP_THREADS = config('FACE_ONNX_INTER_OP_THREADS', default=1, cast=int)
+# Downscale to FACE_WORKING_SIZE px and crop the detected face before embedding
+FACE_PREPROCESS = config('FACE_PREPROCESS', default=True, cast=bool)
+FACE_WORKING_SIZE = config('FACE_WORKING_SIZE', default=640, cast=int)
+# Search every stored avatar for other accounts matching the captured face (1:N)
+FACE_DUPLICATE_CHECK = config('FACE_DUPLICATE_CHECK', default=False, cast=bool)
+FACE_INDEX_DIR = config('FACE_INDEX_DIR', default=str(BASE_DIR / 'face_index'))
+FACE_INDEX_MAX_AGE = config('FACE_INDEX_MAX_AGE', default=300, cast=int)
+FACE_INDEX_TOP_K = config('FACE_INDEX_TOP_K', default=5, cast=int)
+# Quantized (int8 or float16) memory-mapped store of avatar embeddings shared by all workers
+FACE_STORE_ENABLED = config('FACE_STORE_ENABLED', default=False, cast=bool)
+FACE_STORE_DIR = config('FACE_STORE_DIR', default=str(BASE_DIR / 'face_store'))
+FACE_STORE_DTYPE = config('FACE_STORE_DTYPE', default='int8')
+# Rewrite the store once more than this fraction of its records are superseded
+FACE_STORE_COMPACT_RATIO = config('FACE_STORE_COMPACT_RATIO', default=0.5, cast=float)
+# In-meeting re-verification: the room sends a frame every FACE_RECHECK_INTERVAL
+# seconds (0 disables), the server checks at most one per FACE_RECHECK_MIN_INTERVAL
+FACE_RECHECK_INTERVAL = config('FACE_RECHECK_INTERVAL', default=30, cast=int)
+FACE_RECHECK_MIN_INTERVAL = config('FACE_RECHECK_MIN_INTERVAL', default=10, cast=int)
+FACE_RECHECK_MISMATCHES = config('FACE_RECHECK_MISMATCHES', default=2, cast=int)
+# Alert the host when a participant sends no frame for this many intervals (0 disables)
+FACE_RECHECK_MISSED = config('FACE_RECHECK_MISSED', default=3, cast=int)
+FACE_RECHECK_CONCURRENCY = config('FACE_RECHECK_CONCURRENCY', default=4, cast=int)
+# Lobby verifications submitted over the WebSocket that run at once in this process
+FACE_VERIFY_CONCURRENCY = config('FACE_VERIFY_CONCURRENCY', default=4, cast=int)
+# Reuse the last result when a new frame's average hash is within this many bits (of 64)
+FACE_GATE_ENABLED = config('FACE_GATE_ENABLED', default=True, cast=bool)
+FACE_GATE_DISTANCE = config('FACE_GATE_DISTANCE', default=4, cast=int)
+FACE_GATE_TTL = config('FACE_GATE_TTL', default=300, cast=int)
+# Serve exact replays of a frame from the 'face_results' cache
+FACE_RESULT_CACHE_ENABLED = config('FACE_RESULT_CACHE_ENABLED', default=True, cast=bool)
+# Burst verification: the lobby sends FACE_BURST_FRAMES frames per capture and the
+# decision uses their 'median' similarity or the FACE_BURST_BEST_K-th best ('best_k')
+FACE_BURST_FRAMES = config('FACE_BURST_FRAMES', default=3, cast=int)
+FACE_BURST_MAX_FRAMES = config('FACE_BURST_MAX_FRAMES', default=8, cast=int)
+FACE_BURST_AGGREGATE = config('FACE_BURST_AGGREGATE', default='median')
+FACE_BURST_BEST_K = config('FACE_BURST_BEST_K', default=2, cast=int)
+# Reject dark, overexposed, blurred or faceless captures before embedding them.
+# Brightness is the 0-255 mean, sharpness the Laplacian variance of the face
+# crop, face size the shorter side of the detected box at FACE_WORKING_SIZE
+FACE_QUALITY_CHECK = config('FACE_QUALITY_CHECK', default=True, cast=bool)
+FACE_QUALITY_MIN_BRIGHTNESS = config('FACE_QUALITY_MIN_BRIGHTNESS', default=50, cast=int)
+FACE_QUALITY_MAX_BRIGHTNESS = config('FACE_QUALITY_MAX_BRIGHTNESS', default=215, cast=int)
+FACE_QUALITY_MIN_SHARPNESS = config('FACE_QUALITY_MIN_SHARPNESS', default=40.0, cast=float)
+FACE_QUALITY_MIN_FACE_SIZE = config('FACE_QUALITY_MIN_FACE_SIZE', default=80, cast=int)
+# Load and warm the models when each worker starts instead of on the first request
+FACE_WARMUP = config('FACE_WARMUP', default=False, cast=bool)
+# CPU thread budget: FACE_CPU_CORES (0 = the cores this process may run on) are
+# shared by FACE_WEB_WORKERS server processes and their inference pools. The
+# resulting intra-op share (or FACE_INTRA_OP_THREADS, if set) is applied to
+# TensorFlow, ONNX Runtime, OpenCV and BLAS at startup
+FACE_CPU_CORES = config('FACE_CPU_CORES', default=0, cast=int)
+FACE_WEB_WORKERS = config('FACE_WEB_WORKERS', default=1, cast=int)
+FACE_INTRA_OP_THREADS = config('FACE_INTRA_OP_THREADS', default=0, cast=int)
+FACE_INTER_OP_THREADS = config('FACE_INTER_OP_THREADS', default=1, cast=int)
+# Run inference in a separate process pool; 0 workers splits the cores between FACE_WEB_WORKERS
+FACE_POOL_ENABLED = config('FACE_POOL_ENABLED', default=False, cast=bool)
+FACE_POOL_WORKERS = config('FACE_POOL_WORKERS', default=0, cast=int)
+FACE_POOL_QUEUE_SIZE = config('FACE_POOL_QUEUE_SIZE', default=32, cast=int)
+FACE_POOL_TIMEOUT = config('FACE_POOL_TIMEOUT', default=15.0, cast=float)
+# Load shedding: past the DEGRADE limits verify_face switches to FACE_DEGRADE_MODEL
+# (disabled when empty), past the SHED limits it answers 503 + Retry-After at once.
+# Latency is the p95 of verifications finished in the last FACE_LOAD_WINDOW seconds
+FACE_LOAD_WINDOW = config('FACE_LOAD_WINDOW', default=30, cast=int)
+# ... over at least this many of them; fewer leave the latency limits out
+FACE_LOAD_MIN_SAMPLES = config('FACE_LOAD_MIN_SAMPLES', default=20, cast=int)
+FACE_DEGRADE_MODEL = config('FACE_DEGRADE_MODEL', default='')
+FACE_DEGRADE_QUEUE_DEPTH = config('FACE_DEGRADE_QUEUE_DEPTH', default=4, cast=int)
+FACE_DEGRADE_LATENCY_MS = config('FACE_DEGRADE_LATENCY_MS', default=3000, cast=int)
+FACE_SHED_QUEUE_DEPTH = config('FACE_SHED_QUEUE_DEPTH', default=16, cast=int)
+FACE_SHED_LATENCY_MS = config('FACE_SHED_LATENCY_MS', default=10000, cast=int)
+FACE_RETRY_AFTER = config('FACE_RETRY_AFTER', default=5, cast=int)
+# Collect concurrent embedding requests for a short window and run them as one batch
+FACE_BATCH_ENABLED = config('FACE_BATCH_ENABLED', default=False, cast=bool)
+FACE_BATCH_WINDOW_MS = config('FACE_BATCH_WINDOW_MS', default=30, cast=int)
+FACE_BATCH_MAX_SIZE = config('FACE_BATCH_MAX_SIZE', default=16, cast=int)